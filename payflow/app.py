@@ -1,14 +1,15 @@
-# app.py - Version 4.9 (Ajout Authentification + Logo Odoo)
+# app.py - Version 5.0 (Pipeline partagé payflow_core)
 
 import streamlit as st
-import xmlrpc.client
+import numpy as np
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
-from urllib.parse import quote
-import requests
-import json
+import sys
+import tempfile
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Imports Google Cloud ---
 try:
@@ -18,6 +19,20 @@ except ImportError:
     st.error("Bibliothèques GCP manquantes. (google-cloud-firestore, google-cloud-secret-manager)")
     st.stop()
 
+# --- Cœur partagé avec la Cloud Function ---
+try:
+    import payflow_core  # noqa: F401
+except ImportError: # Exécution depuis le dépôt : le package partagé est à la racine
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import payflow_core  # noqa: F401
+
+from payflow_core import (EXPORT_FORMATS, HEALTH_COLLECTION, LOGS_ARCHIVE_URI, LOGS_RETENTION_JOURS, PROFILES_COLLECTION,
+                          SILAE_CACHE_TTL_HEURES, ClientIndex, ImportContext, ImportPipeline, LeaseHook, OdooMetadataCache,
+                          PipelineHook, ProfilingHook, TimingHook, clear_silae_token_cache, export_logs, get_project_id,
+                          health_ok, iter_periodes, read_archived_logs, replan_client, run_backfill)
+from payflow_core import load_silae_secrets as load_silae_secrets_core
+from payflow_core import run_health_check as run_health_check_core
+
 # --- CONFIGURATION DE LA PAGE ---
 st.set_page_config(page_title="PayFlow", layout="wide")
 
@@ -73,23 +88,12 @@ def get_payflow_password():
 @st.cache_data(ttl=60) # Cache court
 def load_silae_secrets():
     """Charge les secrets SILAE depuis Google Secret Manager."""
-    client = get_secret_client()
-    project_id = os.environ.get("GCP_PROJECT")
+    project_id = get_project_id()
     if not project_id:
-        project_id = os.environ.get("GCLOUD_PROJECT")
-        if not project_id:
-            st.error("Variable d'environnement GCP_PROJECT non définie.")
-            return None
-    secrets_to_fetch = ["SILAE_CLIENT_ID", "SILAE_CLIENT_SECRET", "SILAE_SUBSCRIPTION_KEY"]
-    config = {}
+        st.error("Variable d'environnement GCP_PROJECT non définie.")
+        return None
     try:
-        for key in secrets_to_fetch:
-            name = f"projects/{project_id}/secrets/{key}/versions/latest"
-            response = client.access_secret_version(request={"name": name})
-            value = response.payload.data.decode("UTF-8").strip() # .strip() pour nettoyer
-            config_key = key.split('_', 1)[-1].lower()
-            config[config_key] = value
-        return config
+        return load_silae_secrets_core(get_secret_client(), project_id)
     except Exception as e:
         st.error(f"Erreur lors du chargement des secrets Silae : {e}")
         return None
@@ -108,89 +112,57 @@ def load_client_mappings():
         st.error(f"Erreur lors de la lecture des clients Firestore : {e}")
         return {}
 
+@st.cache_resource(max_entries=2)
+def get_client_index(clients_config):
+    """Index de recherche des clients, construit une fois par version de la configuration (clé : son contenu)."""
+    return ClientIndex(clients_config)
+
+def clear_client_caches():
+    """Invalide la configuration clients (l'index suit : il est indexé sur son contenu)."""
+    load_client_mappings.clear()
+
 def add_client_to_firestore(doc_id, data):
-    """Ajoute ou écrase un document client dans Firestore."""
+    """Ajoute ou écrase un document client dans Firestore, puis recale son créneau du mois en cours."""
     try:
         db = get_firestore_client()
         doc_ref = db.collection("payflow_clients").document(doc_id)
         doc_ref.set(data, merge=True)
-        return True
     except Exception as e:
         st.error(f"Erreur d'écriture Firestore : {e}")
         return False
-
-# --- Fonctions de connexion Odoo ---
-def get_odoo_connection_details(odoo_host, database_odoo, odoo_login, odoo_password):
-    """Tente de s'authentifier et retourne les détails de connexion."""
     try:
-        if ".odoo.com" in odoo_host:
-            url_common = f"https://{odoo_host}/xmlrpc/common"
-            url_object = f"https://{odoo_host}/xmlrpc/object"
-        else:
-            url_common = f"https://{odoo_host}/xmlrpc/2/common"
-            url_object = f"https://{odoo_host}/xmlrpc/2/object"
-
-        common = xmlrpc.client.ServerProxy(url_common)
-        uid = common.authenticate(database_odoo, odoo_login, odoo_password, {})
-        if not uid:
-            st.error("Échec de l'authentification Odoo. Vérifiez les identifiants.")
-            return None
-
-        models = xmlrpc.client.ServerProxy(url_object)
-
-        # Fonction execute() imbriquée pour cette session
-        def execute(model, method, *args, **kwargs):
-            # La syntaxe d'execute_kw est (db, uid, password, model, method, args_list, kwargs_dict)
-            return models.execute_kw(database_odoo, uid, odoo_password, model, method, args, kwargs)
-
-        return uid, execute
-
+        nouveau = replan_client(db, doc_id, doc_ref.get().to_dict(), datetime.utcnow())
+        if nouveau:
+            st.toast(f"Créneau du mois en cours recalculé : jour {nouveau['jour']}, {nouveau['heure_debut']}h-{nouveau['heure_fin']}h.")
     except Exception as e:
-        st.error(f"Erreur Odoo (Connexion): {e}")
-        return None
+        st.toast(f"⚠️ Client enregistré, mais son créneau du mois n'a pas pu être recalculé : {e}")
+    return True
 
-@st.cache_data(ttl=600)
-def get_odoo_companies_and_journals(odoo_host, database_odoo, odoo_login, odoo_password):
-    """Récupère les sociétés et les journaux."""
-    journals_dict = {}
-    company_dict = {}
-
-    connection_details = get_odoo_connection_details(odoo_host, database_odoo, odoo_login, odoo_password)
-    if not connection_details:
-        return company_dict, journals_dict # Retourne des dicts vides
+# --- Fonctions de connexion Odoo ---
 
-    uid, execute = connection_details
+@st.cache_resource
+def get_odoo_metadata_cache():
+    """Cache des sociétés/journaux Odoo par jeu d'identifiants, partagé par toutes les sessions."""
+    return OdooMetadataCache(ttl=int(os.environ.get("PAYFLOW_ODOO_METADATA_TTL", "600")))
 
+def get_odoo_companies_and_journals(odoo_host, database_odoo, odoo_login, odoo_password, refresh=False):
+    """Récupère les sociétés et les journaux (depuis le cache, sauf si `refresh`)."""
     try:
-        # 1. Récupérer les sociétés
-        company_ids_data = execute('res.users', 'read', [uid], ['company_ids'])
-        company_ids = company_ids_data[0]['company_ids']
-
-        if not company_ids: # Si vide (rare), tombe sur la société par défaut
-            company_info_data = execute('res.users', 'read', [uid], ['company_id'])
-            company_ids = [company_info_data[0]['company_id'][0]]
-
-        domain_company = [('id', 'in', company_ids)]
-        fields_company = ['name']
-        companies_data = execute('res.company', 'search_read', domain_company, fields=fields_company, order="name")
-        company_dict = {c['id']: c['name'] for c in companies_data}
-
-        # 2. Récupérer les journaux
-        journal_types = ['bank', 'cash', 'sale', 'purchase', 'general']
-        domain_journal = [('type', 'in', journal_types)]
-        fields_journal = ['code', 'name', 'company_id']
-        journals_data = execute('account.journal', 'search_read', domain_journal, fields=fields_journal, order="code")
-
-        journals_dict = {
-            j['code']: f"{j['code']} - {j['name']} ({j['company_id'][1] if j['company_id'] else 'N/A'})"
-            for j in journals_data
-        }
-
-        return company_dict, journals_dict
-
+        return get_odoo_metadata_cache().get(odoo_host, database_odoo, odoo_login, odoo_password, refresh=refresh)
     except Exception as e:
         st.error(f"Erreur Odoo (lecture sociétés/journaux): {e}")
-        return company_dict, journals_dict
+        return {}, {}
+
+def prefetch_odoo_metadata(odoo_host, database_odoo, odoo_login, odoo_password):
+    """Charge en arrière-plan les sociétés/journaux d'un client ouvert (affichés dès le prochain rerun)."""
+    cache = get_odoo_metadata_cache()
+    if all([odoo_host, database_odoo, odoo_login, odoo_password]) and cache.peek(odoo_host, database_odoo, odoo_login, odoo_password) is None:
+        def charger():
+            try:
+                cache.get(odoo_host, database_odoo, odoo_login, odoo_password)
+            except Exception as e:
+                print(f"AVERTISSEMENT: Préchargement Odoo impossible ({odoo_host}): {e}")
+        threading.Thread(target=charger, name="payflow-odoo-metadata", daemon=True).start()
 
 
 @st.cache_data(ttl=60)
@@ -211,156 +183,244 @@ def get_execution_logs():
         st.error(f"Erreur lors de la lecture des logs Firestore : {e}")
         return pd.DataFrame()
 
-# --- FONCTIONS D'IMPORT (Réintégrées depuis la Cloud Function) ---
+def status_colors(statuses):
+    """Couleur CSS de chaque statut (vert : succès, rouge : erreur, orange : autre)."""
+    texte = statuses.fillna("").astype(str)
+    couleurs = np.select([texte.str.contains("SUCCESS"), texte.str.contains("ERROR")], ['color: green', 'color: red'], default='color: orange')
+    return pd.Series(couleurs, index=statuses.index)
 
-@st.cache_data(ttl=60)
-def get_silae_token_manual(SILAE_CONFIG): # --- MODIFIÉ : Passe la config en paramètre
-    """Obtient un token Silae (version pour Streamlit)."""
-    if not SILAE_CONFIG:
-        st.error("Configuration Silae non chargée.")
-        return None
-    auth_url = "https://payroll-api-auth.silae.fr/oauth2/v2.0/token"
+@st.cache_resource(max_entries=8)
+def styled_logs_table(logs_df):
+    """Tableau des logs mis en forme, mémorisé sur son contenu (pas recalculé aux reruns si les logs n'ont pas changé)."""
+    columns_to_display = ['execution_time', 'period', 'client_name', 'status', 'message', 'profil_id']
+    display_df = logs_df[[col for col in columns_to_display if col in logs_df.columns]]
+    return display_df.style.apply(status_colors, subset=['status'])
+
+@st.cache_data(ttl=600)
+def get_archived_logs(date_debut, date_fin, client_doc_id=None):
+    """Charge les logs archivés (Parquet) d'une plage de dates d'exécution."""
     try:
-        client_id = quote(SILAE_CONFIG.get("client_id", ""))
-        client_secret = quote(SILAE_CONFIG.get("client_secret", ""))
-        if not client_id or not client_secret:
-            st.error("Client ID ou Secret Client Silae manquant.")
-            return None
-        grant_type = "client_credentials"
-        scope = quote("https://silaecloudb2c.onmicrosoft.com/36658aca-9556-41b7-9e48-77e90b006f34/.default")
-        auth_data_string = f"grant_type={grant_type}&client_id={client_id}&client_secret={client_secret}&scope={scope}"
-        auth_headers = {"Content-Type": "application/x-www-form-urlencoded"}
-        response = requests.post(auth_url, data=auth_data_string, headers=auth_headers)
-        response.raise_for_status()
-        return response.json()["access_token"]
-    except requests.exceptions.HTTPError as err:
-        response_json = err.response.json()
-        st.error(f"Erreur d'authentification Silae: {response_json.get('error', 'Inconnue')} - {response_json.get('error_description', '')}")
-        return None
+        df = read_archived_logs(datetime.combine(date_debut, datetime.min.time()), datetime.combine(date_fin, datetime.min.time()), client_doc_id=client_doc_id)
+        df['execution_time'] = df['execution_time'].dt.strftime('%Y-%m-%d %H:%M:%S')
+        return df
     except Exception as e:
-        st.error(f"Erreur Silae inattendue (Token): {e}")
-        return None
+        st.error(f"Erreur lors de la lecture des archives de logs : {e}")
+        return pd.DataFrame()
 
-def get_silae_ecritures_manual(access_token, numero_dossier, date_debut, date_fin, SILAE_CONFIG): # --- MODIFIÉ : Passe la config en paramètre
-    """Récupère les écritures Silae (version pour Streamlit)."""
-    api_url = "https://payroll-api.silae.fr/payroll/v1/EcrituresComptables/EcrituresComptables4"
-    subscription_key = SILAE_CONFIG.get("subscription_key")
-    if not subscription_key:
-        st.error("Clé d'abonnement Silae manquante.")
-        return None
-    api_headers = {"Authorization": f"Bearer {access_token}", "Ocp-Apim-Subscription-Key": subscription_key, "Content-Type": "application/json", "dossiers": str(numero_dossier)}
-    api_body = {"numeroDossier": str(numero_dossier), "periodeDebut": date_debut.strftime('%Y-%m-%d'), "periodeFin": date_fin.strftime('%Y-%m-%d'), "avecToutesLesRepartitionsAnalytiques": False}
+@st.cache_data(ttl=600)
+def load_profile(profil_id):
+    """Charge un artefact de profilage (payflow_profiles) référencé par un log."""
     try:
-        response_api = requests.post(api_url, headers=api_headers, data=json.dumps(api_body), timeout=60)
-        response_api.raise_for_status()
-        return response_api.json()
-    except requests.exceptions.RequestException as e:
-        error_details = ""
-        if e.response is not None:
-            try: error_details = e.response.json()
-            except json.JSONDecodeError: error_details = e.response.text
-        st.error(f"Échec de la récupération des écritures Silae: {e} - Détails: {error_details}")
+        doc = get_firestore_client().collection(PROFILES_COLLECTION).document(profil_id).get()
+        return doc.to_dict() if doc.exists else None
+    except Exception as e:
+        st.error(f"Erreur lors de la lecture du profil : {e}")
         return None
 
-def import_to_odoo_auto(client_config, ecritures_data, period_str):
-    """Tente d'importer les écritures dans Odoo (Gère le Multi-Société)."""
-    host = client_config.get('odoo_host')
-    db = client_config.get('database_odoo')
-    username = client_config.get('odoo_login')
-    password = client_config.get('odoo_password')
-    journal_code = client_config.get('journal_paie_odoo')
-    company_id = client_config.get('odoo_company_id')
-
-    if not all([host, db, username, password, journal_code]):
-        raise ValueError("Configuration Odoo manquante (host, db, login, password ou journal).")
-    if not company_id:
-        raise ValueError(f"ID de société Odoo (odoo_company_id) manquant pour le client {client_config.get('nom')}. Veuillez reconfigurer le client dans PayFlow.")
-
-    if ".odoo.com" in host:
-        url_common = f"https://{host}/xmlrpc/common"
-        url_object = f"https://{host}/xmlrpc/object"
-    else:
-        url_common = f"https://{host}/xmlrpc/2/common"
-        url_object = f"https://{host}/xmlrpc/2/object"
+# --- IMPORTS EN ARRIÈRE-PLAN (Job Runner) ---
+
+class ImportJob:
+    """État d'un import lancé en arrière-plan, lu par l'interface en polling."""
+
+    def __init__(self, job_id, type_job, client_doc_id, client_name, period_str, nb_etapes):
+        self.job_id = job_id
+        self.type_job = type_job
+        self.client_doc_id = client_doc_id
+        self.client_name = client_name
+        self.period_str = period_str
+        self.nb_etapes = nb_etapes
+        self.etape = 0
+        self.etape_libelle = "En attente d'un worker"
+        self.statut = "EN_ATTENTE" # EN_ATTENTE, EN_COURS, TERMINE
+        self.status = None # Statut d'import (SUCCESS, ERROR_...)
+        self.message = ""
+        self.fichier = None # Fichier produit par le job (export), supprimé après téléchargement ou à expiration
+        self.nom_fichier = None # Nom proposé au téléchargement
+        self.url = None # URL signée GCS de l'export (PAYFLOW_EXPORT_BUCKET)
+        self.created_at = datetime.now()
+        self.finished_at = None
+
+    def avancer(self, etape, libelle):
+        self.statut = "EN_COURS"
+        self.etape = etape
+        self.etape_libelle = libelle
+
+    def terminer(self, status, message):
+        self.etape = self.nb_etapes
+        self.etape_libelle = "Terminé"
+        self.status = status
+        self.message = message
+        self.finished_at = datetime.now()
+        self.statut = "TERMINE"
+
+    def supprimer_fichier(self):
+        if self.fichier and os.path.exists(self.fichier):
+            os.remove(self.fichier)
+        self.fichier = None
+
+    def as_row(self):
+        return {
+            "Lancé à": self.created_at.strftime('%H:%M:%S'), "Type": self.type_job,
+            "Client": self.client_name, "Période": self.period_str,
+            "Avancement": round(100 * self.etape / self.nb_etapes) if self.nb_etapes else 100,
+            "Étape": self.etape_libelle, "Statut": self.status or self.statut, "Message": self.message,
+        }
 
-    try:
-        journal_silae = ecritures_data['ruptures'][0]
-        lignes_silae = journal_silae.get('ecritures')
-        if not lignes_silae:
-            return "SUCCESS_EMPTY", "Journal Silae vide, rien à importer."
-
-        comptes_odoo_a_verifier = set()
-        lignes_pour_odoo = []
-        for ligne in lignes_silae:
-            code_compte = ligne['compte']
-            lignes_pour_odoo.append({'account_code': code_compte, 'name': ligne['libelle'], 'debit': ligne['valeur'] if ligne['sens'] == 'D' else 0.0, 'credit': ligne['valeur'] if ligne['sens'] == 'C' else 0.0})
-            comptes_odoo_a_verifier.add(code_compte)
-
-        common = xmlrpc.client.ServerProxy(url_common)
-        uid = common.authenticate(db, username, password, {})
-        if not uid:
-            raise Exception("Échec d'authentification Odoo. Vérifiez login/clé API/base de données.")
-
-        models = xmlrpc.client.ServerProxy(url_object)
-
-        context = {'allowed_company_ids': [company_id]}
-
-        def execute(model, method, *args, **kwargs):
-            kwargs.setdefault('context', {}).update(context)
-            return models.execute_kw(db, uid, password, model, method, args, kwargs)
-
-        domain_comptes = [('code', 'in', list(comptes_odoo_a_verifier))]
-        fields_comptes = ['code', 'id']
-        account_data = execute('account.account', 'search_read', domain_comptes, fields=fields_comptes)
-
-        code_to_id_map = {acc['code']: acc['id'] for acc in account_data}
-        comptes_manquants = comptes_odoo_a_verifier - set(code_to_id_map.keys())
-        if comptes_manquants:
-            return "ERROR_ACCOUNT", f"Comptes Odoo introuvables: {sorted(list(comptes_manquants))}. Vérifiez la liaison Silae ET que la bonne société Odoo est sélectionnée."
-
-        domain_journal = [('code', '=', journal_code)]
-        journal_id = execute('account.journal', 'search', domain_journal, limit=1)
-        if not journal_id:
-            return "ERROR_JOURNAL", f"Journal Odoo introuvable (Code: '{journal_code}') dans la société ID {company_id}. Vérifiez la config client."
-        journal_id = journal_id[0]
-        lignes_finales = []
-        for ligne in lignes_pour_odoo:
-            lignes_finales.append((0, 0, {'account_id': code_to_id_map[ligne['account_code']], 'name': ligne['name'], 'debit': ligne['debit'], 'credit': ligne['credit']}))
-
-        move_vals = {'journal_id': journal_id, 'ref': journal_silae.get('libelle', f"Import Paie Silae {period_str}"), 'date': datetime.now().strftime('%Y-%m-%d'), 'line_ids': lignes_finales}
-        move_id = execute('account.move', 'create', move_vals)
-
-        move_info = execute('account.move', 'read', [move_id], ['name'])
-        move_name = move_info[0].get('name') if move_info and move_info[0].get('name') else f"ID {move_id}"
-        return "SUCCESS", f"Pièce créée (Brouillon): {move_name}"
-
-    except xmlrpc.client.Fault as e:
-        st.error(traceback.format_exc())
-        return "ERROR_ODOO_RPC", f"Erreur Odoo (Fault): {str(e)}"
-    except Exception as e:
-        st.error(traceback.format_exc())
-        return "ERROR_UNKNOWN", f"Erreur inattendue: {str(e)}"
 
+class ImportJobRunner:
+    """Pool de threads + registre des jobs, partagé par toutes les sessions du processus Streamlit."""
+
+    def __init__(self, max_workers=4, max_jobs_termines=50):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="payflow-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._compteur = 0
+        self.max_jobs_termines = max_jobs_termines
+
+    def submit(self, type_job, client_doc_id, client_name, period_str, nb_etapes, fn, *args):
+        """Enregistre un job et lance `fn(job, *args)` dans le pool."""
+        with self._lock:
+            self._compteur += 1
+            job = ImportJob(f"job-{self._compteur}", type_job, client_doc_id, client_name, period_str, nb_etapes)
+            self._jobs[job.job_id] = job
+            self._purger()
+        self._executor.submit(self._run, job, fn, *args)
+        return job
+
+    def _run(self, job, fn, *args):
+        try:
+            fn(job, *args)
+        except Exception as e:
+            print(f"ERREUR Job {job.job_id} ({job.client_name}): {e}")
+            traceback.print_exc()
+            job.terminer(f"ERROR_FUNCTION ({type(e).__name__})", str(e))
+        get_execution_logs.clear()
+
+    def _purger(self):
+        termines = [j for j in self._jobs.values() if j.statut == "TERMINE"]
+        for job in termines[:max(len(termines) - self.max_jobs_termines, 0)]:
+            del self._jobs[job.job_id]
+            job.supprimer_fichier()
+        expiration = datetime.now() - timedelta(minutes=EXPORT_TTL_MINUTES)
+        for job in termines: # /tmp est en mémoire sur Cloud Run : les exports non téléchargés expirent
+            if job.fichier and job.finished_at < expiration:
+                job.supprimer_fichier()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            self._purger()
+            return sorted(self._jobs.values(), key=lambda j: j.created_at, reverse=True)
+
+    def has_active(self):
+        return any(j.statut != "TERMINE" for j in self.jobs())
+
+
+@st.cache_resource
+def get_job_runner():
+    """Runner unique par processus (les jobs survivent aux reruns et aux sessions)."""
+    return ImportJobRunner(max_workers=int(os.environ.get("PAYFLOW_JOB_WORKERS", "4")))
+
+
+class JobProgressHook(PipelineHook):
+    """Reporte l'étape en cours du pipeline sur le job (polling de l'interface)."""
+
+    LIBELLES = {"fetch": "Récupération des écritures Silae", "transform": "Préparation des lignes", "resolve": "Résolution comptes/journal Odoo",
+                "create": "Création de la pièce Odoo", "log": "Enregistrement du log"}
+
+    def __init__(self, job):
+        self.job = job
+
+    def before_stage(self, stage, ctx):
+        self.job.avancer(list(self.LIBELLES).index(stage), self.LIBELLES[stage])
+        return False
+
+
+def run_manual_import_job(job, client_doc_id, client_config, date_debut, date_fin, SILAE_CONFIG, force_refresh=False):
+    """Import manuel d'une période (exécuté dans un thread du runner, sans appel st.*)."""
+    pipeline = ImportPipeline(db=get_firestore_client(), status_prefix="MANUAL_", no_data_status="ERROR_NO_DATA", hooks=[LeaseHook(get_firestore_client(), forcer=True), TimingHook(), ProfilingHook(get_firestore_client()), JobProgressHook(job)])
+    ctx = ImportContext(client_doc_id, client_config, job.period_str, date_debut, date_fin, SILAE_CONFIG, force_refresh=force_refresh)
+    status, message = pipeline.run(ctx)
+    job.terminer(status, message)
+
+
+def run_backfill_job(job, client_doc_id, client_config, date_debut, date_fin, SILAE_CONFIG, force_refresh=False):
+    """Backfill d'une plage (exécuté dans un thread du runner) : une étape par période."""
+    job.avancer(0, "Récupération des écritures Silae pour la plage")
+    termines = []
+
+    def progression(period_str, status, message):
+        termines.append((period_str, status))
+        job.avancer(len(termines), f"{period_str} : {status}")
+
+    resultats = run_backfill(get_firestore_client(), client_doc_id, client_config, date_debut, date_fin, SILAE_CONFIG, progress_callback=progression, force_refresh=force_refresh)
+    nb_ok = sum(1 for status, _ in resultats.values() if status.startswith("SUCCESS"))
+    erreurs = [f"{p}: {m}" for p, (status, m) in sorted(resultats.items()) if not status.startswith("SUCCESS")]
+    status = "SUCCESS" if nb_ok == len(resultats) else "ERROR_PARTIAL"
+    job.terminer(status, f"{nb_ok}/{len(resultats)} période(s) en succès." + (" " + " | ".join(erreurs) if erreurs else ""))
+
+EXPORT_BUCKET = os.environ.get("PAYFLOW_EXPORT_BUCKET") # Exports servis par URL signée GCS (sinon depuis /tmp)
+EXPORT_TTL_MINUTES = int(os.environ.get("PAYFLOW_EXPORT_TTL_MINUTES", "30"))
+
+def publish_export(path, nom_fichier):
+    """Envoie l'export dans PAYFLOW_EXPORT_BUCKET (en flux depuis le disque) et retourne une URL signée de téléchargement."""
+    import google.auth
+    from google.auth.transport import requests as google_requests
+    from google.cloud import storage
+
+    credentials, project = google.auth.default()
+    credentials.refresh(google_requests.Request()) # Jeton requis pour signer via IAM (compte de service Cloud Run, sans clé)
+    blob = storage.Client(credentials=credentials, project=project).bucket(EXPORT_BUCKET).blob(f"exports/{datetime.utcnow():%Y%m%dT%H%M%S}_{nom_fichier}")
+    blob.upload_from_filename(path)
+    return blob.generate_signed_url(version="v4", expiration=timedelta(minutes=EXPORT_TTL_MINUTES), method="GET",
+                                    service_account_email=getattr(credentials, "service_account_email", None), access_token=credentials.token,
+                                    response_disposition=f'attachment; filename="{nom_fichier}"')
+
+def run_export_job(job, fmt, date_debut, date_fin, client_doc_id=None, status=None):
+    """Export des logs (exécuté dans un thread du runner) : écrit un fichier temporaire mois par mois, puis le publie sur GCS si configuré."""
+    fd, job.fichier = tempfile.mkstemp(prefix="payflow_logs_", suffix=f".{fmt}")
+    os.close(fd)
+    job.nom_fichier = f"payflow_logs_{job.period_str.replace(' ➔ ', '_')}.{fmt}"
+
+    def progression(mois_traites, nb_mois, lignes):
+        job.nb_etapes = nb_mois
+        job.avancer(mois_traites, f"{lignes} lignes exportées")
+
+    lignes = export_logs(get_firestore_client(), job.fichier, fmt, date_debut, date_fin, client_doc_id=client_doc_id, status=status, progress_callback=progression)
+    if EXPORT_BUCKET:
+        try:
+            job.url = publish_export(job.fichier, job.nom_fichier)
+            job.supprimer_fichier()
+        except Exception as e:
+            print(f"AVERTISSEMENT: Export non publié sur gs://{EXPORT_BUCKET} (servi depuis /tmp): {e}")
+    job.terminer("SUCCESS", f"{lignes} lignes exportées.")
+
+# --- FIN IMPORTS EN ARRIÈRE-PLAN ---
+
+# --- CONTRÔLE DE SANTÉ DES CONNEXIONS ODOO ---
+
+def run_health_check_job(job, clients_config, SILAE_CONFIG=None, verifier_comptes=False):
+    """Contrôle de santé (exécuté dans un thread du runner) : tous les clients en parallèle, puis invalide la grille affichée."""
+    results = run_health_check_core(get_firestore_client(), clients_config, SILAE_CONFIG, verifier_comptes=verifier_comptes,
+                                    progress_callback=lambda n, total: job.avancer(n, f"{n}/{total} clients contrôlés"))
+    load_health_results.clear()
+    erreurs = sum(1 for r in results if not health_ok(r))
+    job.terminer("SUCCESS" if not erreurs else "SUCCESS_WITH_ERRORS", f"{len(results)} clients contrôlés, {erreurs} en erreur.")
 
-def log_execution(client_doc_id, client_name, period_str, status, message):
-    """Enregistre le résultat dans la collection payflow_logs de Firestore."""
+@st.cache_data(ttl=600)
+def load_health_results():
+    """Charge le dernier contrôle de santé de chaque client depuis Firestore."""
     db = get_firestore_client()
-    if not db:
-        st.error(f"ERREUR: Client Firestore non dispo, log non enregistré pour {client_doc_id}")
-        return
     try:
-        log_entry = {
-            "client_doc_id": client_doc_id, "client_name": client_name,
-            "period": period_str, "execution_time": datetime.utcnow(),
-            "status": status, "message": message[:1500]
-        }
-        log_doc_id = f"{client_doc_id}_{period_str}_{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}"
-        db.collection("payflow_logs").document(log_doc_id).set(log_entry)
-        st.success(f"Log enregistré pour {client_name} - Statut: {status}")
+        return {doc.id: doc.to_dict() for doc in db.collection(HEALTH_COLLECTION).stream()}
     except Exception as e:
-        st.error(f"ERREUR: Échec d'écriture du log Firestore pour {client_doc_id}: {e}")
+        st.error(f"Erreur lors de la lecture des contrôles de santé : {e}")
+        return {}
 
-# --- FIN DES FONCTIONS D'IMPORT ---
+# --- FIN CONTRÔLE DE SANTÉ ---
 
 
 # --- NOUVEAU : GESTION DE L'AUTHENTIFICATION ---
@@ -389,6 +449,27 @@ def check_login():
         st.error(f"Erreur lors de la vérification du mot de passe : {e}")
         st.session_state.logged_in = False
 
+# --- ÉTAT DES ONGLETS ---
+# Seul l'onglet actif est rendu : Streamlit supprime l'état des widgets des autres onglets.
+# Leurs clés sont réassignées à chaque exécution pour survivre aux changements d'onglet.
+WIDGETS_PERSISTANTS = [
+    "logs_profil_id", "archive_periode", "archive_client", "export_periode", "export_client", "export_status", "export_format",
+    "admin_client_search", "admin_client_loader", "admin_numero_silae", "admin_nom", "admin_jour_transfert", "admin_odoo_host",
+    "admin_odoo_login", "admin_database_odoo", "admin_odoo_password", "admin_selected_company", "admin_selected_journal",
+    "clients_list_search", "clients_list_page", "health_verifier_comptes",
+    "manual_mode", "manual_force_refresh", "backfill_client", "backfill_month_from", "backfill_year_from", "backfill_month_to",
+    "backfill_year_to", "manual_clients", "manual_month", "manual_year",
+]
+
+def conserver_widgets():
+    for key in WIDGETS_PERSISTANTS:
+        if key in st.session_state:
+            st.session_state[key] = st.session_state[key]
+
+def defaut_widget(key, **defaut):
+    """Valeur par défaut d'un widget, omise si son état est déjà en session (évite l'avertissement Streamlit)."""
+    return {} if key in st.session_state else defaut
+
 # --- INTERFACE PRINCIPALE (conditionnée par le login) ---
 
 if not st.session_state.logged_in:
@@ -431,38 +512,29 @@ else:
         if st.button("Se déconnecter"):
             st.session_state.logged_in = False
             # Nettoyer les caches de données spécifiques à la session si nécessaire
-            get_silae_token_manual.clear()
+            clear_silae_token_cache()
             get_execution_logs.clear()
-            load_client_mappings.clear()
+            clear_client_caches()
             st.rerun()
 
-    # --- CHARGEMENT DE LA CONFIGURATION (uniquement après login) ---
-    with st.spinner("Chargement de la configuration..."):
-        SILAE_CONFIG = load_silae_secrets()
-        CLIENTS_CONFIG = load_client_mappings()
-
-    if not SILAE_CONFIG:
-        st.error("Échec critique: Configuration Silae (Secrets) non chargée. L'import manuel est désactivé.")
-
-    if not CLIENTS_CONFIG:
-        st.info("Aucun client configuré. Veuillez en ajouter un dans l'onglet 'Administration'.")
-
     # --- INTERFACE PRINCIPALE (Onglets) ---
+    # Chaque onglet est un fragment : seul l'onglet actif est exécuté (et charge ses données),
+    # et une interaction dans un onglet ne ré-exécute que lui.
 
-    tab_logs, tab_admin, tab_manual_import = st.tabs([
-        "📊 Journal des Exécutions",
-        "⚙️ Administration des Clients",
-        "⚡ Import Manuel"
-    ])
+    conserver_widgets()
+    ONGLETS = ["📊 Journal des Exécutions", "⚙️ Administration des Clients", "⚡ Import Manuel"]
+    onglet_actif = st.radio("Onglet", ONGLETS, horizontal=True, key="onglet_actif", label_visibility="collapsed")
 
     # --- Onglet 1: Journal des Exécutions ---
-    with tab_logs:
+    @st.fragment
+    def onglet_logs():
+        CLIENTS_CONFIG = load_client_mappings()
         st.header("Historique des imports mensuels automatisés")
 
         col1, col2 = st.columns([3, 1])
         with col2:
             if st.button("Rafraîchir les logs"):
-                get_execution_logs.clear(); load_client_mappings.clear(); st.rerun()
+                get_execution_logs.clear(); clear_client_caches(); st.rerun()
         with col1:
             st.info("Cette page affiche les 100 derniers résultats d'import (succès ou échec) de la fonction automatisée.")
 
@@ -474,26 +546,125 @@ else:
             st.info("La fonction automatisée ne s'est peut-être pas encore exécutée. Vous pouvez la forcer via Cloud Scheduler.")
         else:
             st.subheader("Dernières exécutions")
-            def color_status(val):
-                if "SUCCESS" in val: color = 'green'
-                elif "ERROR" in val: color = 'red'
-                else: color = 'orange'
-                return f'color: {color}'
-            columns_to_display = ['execution_time', 'period', 'client_name', 'status', 'message']
-            display_df = logs_df[[col for col in columns_to_display if col in logs_df.columns]]
-            st.dataframe(display_df.style.applymap(color_status, subset=['status']), use_container_width=True)
+            st.dataframe(styled_logs_table(logs_df), use_container_width=True)
+
+            profil_ids = logs_df['profil_id'].dropna().tolist() if 'profil_id' in logs_df.columns else []
+            if profil_ids:
+                with st.expander("🔬 Profils d'exécution (clients profilés)"):
+                    profil_id = st.selectbox("Profil", options=profil_ids, key="logs_profil_id")
+                    profil = load_profile(profil_id)
+                    if not profil:
+                        st.warning("Profil introuvable dans payflow_profiles.")
+                    else:
+                        st.caption(f"Durées (ms) : {profil.get('durees_ms')} | Lignes : {profil.get('nb_lignes')} | Pic mémoire : {profil.get('memoire_pic_ko')} Ko | Allocations : {profil.get('allocations', 'complètes')} | Fichiers : {profil.get('fichier', 'N/A')}")
+                        st.markdown("**Fonctions (temps cumulé)**")
+                        st.dataframe(pd.DataFrame(profil.get('top_fonctions', [])), use_container_width=True)
+                        st.markdown("**Allocations mémoire**")
+                        st.dataframe(pd.DataFrame(profil.get('top_allocations', [])), use_container_width=True)
+
+        st.divider()
+        st.subheader("🗄️ Historique archivé")
+        st.caption(f"Les logs de plus de {LOGS_RETENTION_JOURS} jours sont archivés en Parquet (`{LOGS_ARCHIVE_URI}`) par la tâche de compaction.")
+        col_a1, col_a2 = st.columns(2)
+        with col_a1:
+            archive_periode = st.date_input("Dates d'exécution", key="archive_periode",
+                                            **defaut_widget("archive_periode", value=(datetime.now().date() - timedelta(days=LOGS_RETENTION_JOURS + 30), datetime.now().date() - timedelta(days=LOGS_RETENTION_JOURS))))
+        with col_a2:
+            archive_client = st.selectbox("Client", options=["Tous"] + sorted(CLIENTS_CONFIG), format_func=lambda c: c if c == "Tous" else CLIENTS_CONFIG[c].get("nom", c), key="archive_client")
+        if isinstance(archive_periode, (tuple, list)) and len(archive_periode) == 2 and st.button("Consulter les archives", key="archive_consulter"):
+            with st.spinner("Lecture des archives Parquet..."):
+                archives_df = get_archived_logs(archive_periode[0], archive_periode[1], None if archive_client == "Tous" else archive_client)
+            if archives_df.empty:
+                st.info("Aucun log archivé sur cette plage.")
+            else:
+                st.write(f"{len(archives_df)} log(s) archivé(s).")
+                st.dataframe(styled_logs_table(archives_df), use_container_width=True)
+
+        st.divider()
+        st.subheader("📤 Export des logs (audit)")
+        st.caption("Export complet d'une plage (archives + logs récents), préparé en arrière-plan page par page puis proposé au téléchargement.")
+        with st.form("export_logs_form"):
+            col_e1, col_e2, col_e3, col_e4 = st.columns(4)
+            with col_e1:
+                export_periode = st.date_input("Dates d'exécution", key="export_periode",
+                                               **defaut_widget("export_periode", value=(datetime.now().date() - timedelta(days=365), datetime.now().date())))
+            with col_e2:
+                export_client = st.selectbox("Client", options=["Tous"] + sorted(CLIENTS_CONFIG), format_func=lambda c: c if c == "Tous" else CLIENTS_CONFIG[c].get("nom", c), key="export_client")
+            with col_e3:
+                export_status = st.text_input("Statut exact (optionnel)", key="export_status", placeholder="ex: SUCCESS")
+            with col_e4:
+                export_format = st.radio("Format", options=EXPORT_FORMATS, format_func=str.upper, horizontal=True, key="export_format")
+            if st.form_submit_button("Préparer l'export"):
+                if not (isinstance(export_periode, (tuple, list)) and len(export_periode) == 2):
+                    st.error("Veuillez choisir une date de début et une date de fin.")
+                else:
+                    client_doc_id = None if export_client == "Tous" else export_client
+                    job = get_job_runner().submit("EXPORT", client_doc_id or "GLOBAL", CLIENTS_CONFIG.get(client_doc_id, {}).get("nom", "Tous les clients"),
+                                                  f"{export_periode[0]:%Y-%m-%d} ➔ {export_periode[1]:%Y-%m-%d}", 1,
+                                                  run_export_job, export_format, export_periode[0], export_periode[1], client_doc_id, export_status.strip() or None)
+                    st.session_state.export_job_id = job.job_id
+
+        def afficher_export():
+            job = get_job_runner().get(st.session_state.get("export_job_id"))
+            if job is None:
+                return
+            if job.statut != "TERMINE":
+                st.progress(job.etape / job.nb_etapes if job.nb_etapes else 0.0, text=f"Export en cours : {job.etape_libelle}")
+            elif st.session_state.get("export_polling"):
+                st.session_state.export_polling = False
+                st.rerun() # Arrête le polling du fragment
+            elif job.status != "SUCCESS":
+                st.error(f"Échec de l'export : {job.message}")
+            elif job.url:
+                # Servi directement par GCS : le fichier ne transite pas par la mémoire de l'application.
+                st.link_button(f"⬇️ Télécharger ({job.message})", job.url)
+                st.caption(f"Lien valable {EXPORT_TTL_MINUTES} minutes.")
+            elif job.fichier and os.path.exists(job.fichier):
+                # Sans bucket : fichier lu seulement à la demande, puis supprimé de /tmp après le téléchargement.
+                if st.session_state.get("export_download_pret") != job.job_id:
+                    if st.button(f"📦 Préparer le téléchargement ({job.message})", key="export_preparer"):
+                        st.session_state.export_download_pret = job.job_id
+                        st.rerun(scope="fragment")
+                else:
+                    with open(job.fichier, "rb") as f:
+                        st.download_button(f"⬇️ Télécharger ({job.message})", data=f.read(), file_name=job.nom_fichier,
+                                           mime="text/csv" if job.nom_fichier.endswith(".csv") else "application/octet-stream", key="export_download",
+                                           on_click=lambda: (job.supprimer_fichier(), st.session_state.update(export_download_pret=None)))
+            else:
+                st.info("Export déjà téléchargé ou expiré. Relancez l'export si besoin.")
+
+        export_job = get_job_runner().get(st.session_state.get("export_job_id"))
+        st.session_state.export_polling = bool(export_job) and export_job.statut != "TERMINE"
+        st.fragment(run_every=2 if st.session_state.export_polling else None)(afficher_export)()
 
     # --- Onglet 2: Administration des Clients ---
-    with tab_admin:
+    @st.fragment
+    def onglet_admin():
+        with st.spinner("Chargement de la configuration..."):
+            SILAE_CONFIG = load_silae_secrets()
+            CLIENTS_CONFIG = load_client_mappings()
+            CLIENT_INDEX = get_client_index(CLIENTS_CONFIG)
+        if not CLIENTS_CONFIG:
+            st.info("Aucun client configuré. Ajoutez-en un ci-dessous.")
+
         st.header("Gérer les connexions clients")
         st.info("Ajoutez ou modifiez les clients qui seront traités par la fonction mensuelle.")
 
-        client_options = {"-- Nouveau Client --": None}
-        client_options.update({cfg.get("nom", doc_id): doc_id for doc_id, cfg in sorted(CLIENTS_CONFIG.items(), key=lambda item: item[1].get("nom", item[0]))})
+        if "admin_client_loader" not in st.session_state: # Formulaire neuf : aucune société/journal d'un autre client
+            st.session_state.admin_odoo_connection_tested = False
+            st.session_state.admin_odoo_companies_list = {}; st.session_state.admin_odoo_journals_list = {}
+            st.session_state.pop("admin_selected_company", None); st.session_state.pop("admin_selected_journal", None)
 
-        if st.session_state.get("client_saved_successfully", False):
-            st.session_state.admin_client_loader = "-- Nouveau Client --"
-            st.session_state.client_saved_successfully = False
+        ADMIN_MAX_OPTIONS = 50
+        recherche_admin = st.text_input("Rechercher un client (nom, dossier Silae, hôte Odoo, journal)", key="admin_client_search", placeholder="ex: dupont, 12345, acme.odoo.com")
+        resultats_admin = CLIENT_INDEX.search(recherche_admin)
+        client_options = {"-- Nouveau Client --": None}
+        client_options.update({CLIENT_INDEX.label(doc_id): doc_id for doc_id in resultats_admin[:ADMIN_MAX_OPTIONS]})
+        client_charge = st.session_state.get("admin_numero_silae")
+        if client_charge in CLIENTS_CONFIG and CLIENT_INDEX.label(client_charge) not in client_options: # Le client en cours d'édition reste sélectionnable
+            client_options[CLIENT_INDEX.label(client_charge)] = client_charge
+        if len(resultats_admin) > ADMIN_MAX_OPTIONS:
+            st.caption(f"{len(resultats_admin)} clients correspondent : seuls les {ADMIN_MAX_OPTIONS} premiers sont proposés, affinez la recherche.")
 
         def load_form_data():
             selected_doc_id = client_options.get(st.session_state.admin_client_loader)
@@ -508,11 +679,18 @@ else:
                 st.session_state.admin_odoo_password = cfg.get("odoo_password", "")
                 st.session_state.admin_journal_actuel = cfg.get("journal_paie_odoo", "")
                 st.session_state.admin_company_actuelle = cfg.get("odoo_company_id", None) # Charge l'ID de société
+                prefetch_odoo_metadata(cfg.get("odoo_host"), cfg.get("database_odoo"), cfg.get("odoo_login"), cfg.get("odoo_password"))
             else:
                 st.session_state.admin_numero_silae = ""; st.session_state.admin_nom = ""; st.session_state.admin_jour_transfert = 1
                 st.session_state.admin_odoo_host = ""; st.session_state.admin_database_odoo = ""; st.session_state.admin_odoo_login = ""
                 st.session_state.admin_odoo_password = ""; st.session_state.admin_journal_actuel = ""; st.session_state.admin_company_actuelle = None
             st.session_state.admin_odoo_journals_list = {}; st.session_state.admin_odoo_companies_list = {}; st.session_state.admin_odoo_connection_tested = False
+            st.session_state.pop("admin_selected_company", None); st.session_state.pop("admin_selected_journal", None) # Repris du client chargé
+
+        if st.session_state.get("client_saved_successfully", False): # Formulaire vidé, sans la connexion testée du client enregistré
+            st.session_state.admin_client_loader = "-- Nouveau Client --"
+            st.session_state.client_saved_successfully = False
+            load_form_data()
 
         st.selectbox("Charger un client pour modification", options=client_options.keys(), key="admin_client_loader", on_change=load_form_data)
 
@@ -524,42 +702,50 @@ else:
         if 'admin_odoo_companies_list' not in st.session_state: st.session_state.admin_odoo_companies_list = {} # Ajout
         if 'admin_odoo_connection_tested' not in st.session_state: st.session_state.admin_odoo_connection_tested = False
 
+        # Client existant : sociétés/journaux affichés directement s'ils sont déjà en cache pour ces identifiants
+        if not st.session_state.admin_odoo_connection_tested and st.session_state.admin_client_loader != "-- Nouveau Client --":
+            cached = get_odoo_metadata_cache().peek(st.session_state.admin_odoo_host, st.session_state.admin_database_odoo, st.session_state.admin_odoo_login, st.session_state.admin_odoo_password)
+            if cached and cached[0]:
+                st.session_state.admin_odoo_companies_list, st.session_state.admin_odoo_journals_list = cached
+                st.session_state.admin_odoo_connection_tested = True
+
         st.markdown("---")
 
         with st.form(key="client_form"):
             st.subheader("Informations du client")
             col1, col2, col3 = st.columns(3)
             with col1:
-                numero_dossier_silae = st.text_input("Numéro Dossier Silae (ID unique)", key="admin_numero_silae")
+                st.text_input("Numéro Dossier Silae (ID unique)", key="admin_numero_silae")
             with col2:
-                nom = st.text_input("Nom du client (pour l'affichage)", key="admin_nom")
+                st.text_input("Nom du client (pour l'affichage)", key="admin_nom")
             with col3:
-                jour_transfert = st.number_input("Jour du mois pour le transfert", min_value=1, max_value=31, step=1, key="admin_jour_transfert")
+                st.number_input("Jour du mois pour le transfert", min_value=1, max_value=31, step=1, key="admin_jour_transfert")
 
             st.subheader("Configuration Odoo (spécifique au client)")
             col1, col2 = st.columns(2)
             with col1:
-                odoo_host = st.text_input("Hôte Odoo (ex: instance.odoo.com)", key="admin_odoo_host")
-                odoo_login = st.text_input("Login Odoo (API)", key="admin_odoo_login")
+                st.text_input("Hôte Odoo (ex: instance.odoo.com)", key="admin_odoo_host")
+                st.text_input("Login Odoo (API)", key="admin_odoo_login")
             with col2:
-                database_odoo = st.text_input("Base de données Odoo", key="admin_database_odoo")
-                odoo_password = st.text_input("Clé API Odoo (Password)", type="password", key="admin_odoo_password")
+                st.text_input("Base de données Odoo", key="admin_database_odoo")
+                st.text_input("Clé API Odoo (Password)", type="password", key="admin_odoo_password")
 
             load_data_button = st.form_submit_button("Tester connexion Odoo & Charger Sociétés/Journaux")
 
             if load_data_button:
                 if all([st.session_state.admin_odoo_host, st.session_state.admin_database_odoo, st.session_state.admin_odoo_login, st.session_state.admin_odoo_password]):
                     with st.spinner("Chargement des Sociétés et Journaux Odoo..."):
-                        # --- MODIFIÉ : Clear cache spécifique avant appel ---
-                        get_odoo_companies_and_journals.clear()
+                        # Test explicite : recharge uniquement l'entrée de ces identifiants
                         companies, journals = get_odoo_companies_and_journals(
                             st.session_state.admin_odoo_host,
                             st.session_state.admin_database_odoo,
                             st.session_state.admin_odoo_login,
-                            st.session_state.admin_odoo_password
+                            st.session_state.admin_odoo_password,
+                            refresh=True
                         )
                         st.session_state.admin_odoo_companies_list = companies
                         st.session_state.admin_odoo_journals_list = journals
+                        st.session_state.pop("admin_selected_company", None); st.session_state.pop("admin_selected_journal", None)
                         if not companies or (not journals and not companies): # Accepte si juste les sociétés chargent
                             st.error("Impossible de charger les sociétés ou les journaux. Vérifiez les infos Odoo.")
                             st.session_state.admin_odoo_connection_tested = False
@@ -585,7 +771,7 @@ else:
                         try:
                             default_index_company = company_display_options.index(f"{default_company_name} (ID: {st.session_state.admin_company_actuelle})")
                         except ValueError: pass
-                    selected_company_display = st.selectbox("Société Odoo à utiliser", options=company_display_options, index=default_index_company, key="admin_selected_company")
+                    selected_company_display = st.selectbox("Société Odoo à utiliser", options=company_display_options, key="admin_selected_company", **defaut_widget("admin_selected_company", index=default_index_company))
                     selected_company_id = int(selected_company_display.split('(ID: ')[1].replace(')', ''))
                 elif len(company_options) == 1:
                     selected_company_id = list(company_options.keys())[0]
@@ -599,7 +785,7 @@ else:
                     default_index_journal = 0
                     journal_actuel_str = st.session_state.admin_odoo_journals_list.get(st.session_state.admin_journal_actuel)
                     if journal_actuel_str in journal_options: default_index_journal = journal_options.index(journal_actuel_str)
-                    selected_journal_display = st.selectbox("Journal Odoo pour la Paie", options=journal_options, index=default_index_journal, key="admin_selected_journal")
+                    selected_journal_display = st.selectbox("Journal Odoo pour la Paie", options=journal_options, key="admin_selected_journal", **defaut_widget("admin_selected_journal", index=default_index_journal))
                     if selected_journal_display: selected_journal_code = selected_journal_display.split(" - ")[0]
                 else:
                     st.warning("Aucun journal compatible trouvé.")
@@ -636,7 +822,7 @@ else:
                         success = add_client_to_firestore(doc_id=st.session_state.admin_numero_silae, data=client_data)
                         if success:
                             st.success(f"Client '{st.session_state.admin_nom}' ajouté/mis à jour avec succès !")
-                            load_client_mappings.clear(); st.session_state.client_saved_successfully = True; st.rerun()
+                            clear_client_caches(); st.session_state.client_saved_successfully = True; st.rerun()
                         else: st.error("Une erreur est survenue lors de l'ajout.")
 
         st.divider()
@@ -645,80 +831,191 @@ else:
         if not CLIENTS_CONFIG:
             st.info("Aucun client configuré.")
         else:
-            clients_list = []
-            for doc_id, config in CLIENTS_CONFIG.items():
-                clients_list.append({
-                    "ID Document (N° Silae)": doc_id, "Nom Client": config.get("nom", "N/A"),
-                    "Jour Transfert": config.get("jour_transfert", "N/A"),
-                    "Hôte Odoo": config.get("odoo_host", "N/A"),
-                    "Base Odoo": config.get("database_odoo", "N/A"),
-                    "Journal Paie Odoo": config.get("journal_paie_odoo", "N/A"),
-                    "ID Société Odoo": config.get("odoo_company_id", "Non concerné") # Ajout pour vérification
+            CLIENTS_PAR_PAGE = 25
+            col_r1, col_r2 = st.columns([3, 1])
+            with col_r1:
+                recherche_liste = st.text_input("Filtrer (nom, dossier Silae, hôte Odoo, journal)", key="clients_list_search")
+            nb_resultats = len(CLIENT_INDEX.search(recherche_liste))
+            nb_pages = max((nb_resultats + CLIENTS_PAR_PAGE - 1) // CLIENTS_PAR_PAGE, 1)
+            with col_r2:
+                if st.session_state.get("clients_list_page", 1) > nb_pages: # Page conservée d'une recherche plus large
+                    st.session_state.clients_list_page = nb_pages
+                page_liste = st.number_input(f"Page (sur {nb_pages})", min_value=1, max_value=nb_pages, step=1, key="clients_list_page", **defaut_widget("clients_list_page", value=1))
+            doc_ids_page, _ = CLIENT_INDEX.page(recherche_liste, page=min(page_liste, nb_pages), page_size=CLIENTS_PAR_PAGE)
+            st.caption(f"{nb_resultats} client(s) sur {len(CLIENT_INDEX)}.")
+            if doc_ids_page:
+                st.dataframe(pd.DataFrame([CLIENT_INDEX.row(doc_id) for doc_id in doc_ids_page]), use_container_width=True, hide_index=True)
+
+        st.divider()
+
+        st.subheader("🩺 Santé des connexions Odoo")
+        st.info("Vérifie en parallèle l'authentification, l'accès à la société, le journal et (optionnel) la couverture des comptes de la dernière paie Silae pour tous les clients. À lancer avant les jours de transfert chargés.")
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            verifier_comptes = st.checkbox("Vérifier aussi les comptes (1 appel Silae par client, mois précédent)", key="health_verifier_comptes", disabled=not SILAE_CONFIG)
+        with col2:
+            lancer_controle = st.button("Contrôler tous les clients", disabled=not CLIENTS_CONFIG)
+        if lancer_controle:
+            job = get_job_runner().submit("SANTE", "GLOBAL", "Tous les clients", "-", len(CLIENTS_CONFIG),
+                                          run_health_check_job, CLIENTS_CONFIG, SILAE_CONFIG, verifier_comptes)
+            st.session_state.health_job_id = job.job_id
+
+        def afficher_controle():
+            job = get_job_runner().get(st.session_state.get("health_job_id"))
+            if job is None:
+                return
+            if job.statut != "TERMINE":
+                st.progress(job.etape / job.nb_etapes if job.nb_etapes else 0.0, text=f"Contrôle en cours : {job.etape_libelle}")
+            elif st.session_state.get("health_polling"):
+                st.session_state.health_polling = False
+                st.rerun() # Arrête le polling et recharge la grille
+            elif job.status.startswith("SUCCESS"):
+                st.caption(f"Dernier contrôle lancé ici : {job.message}")
+            else:
+                st.error(f"Échec du contrôle de santé : {job.message}")
+
+        health_job = get_job_runner().get(st.session_state.get("health_job_id"))
+        st.session_state.health_polling = bool(health_job) and health_job.statut != "TERMINE"
+        st.fragment(run_every=2 if st.session_state.health_polling else None)(afficher_controle)()
+
+        health_results = load_health_results()
+        if not health_results:
+            st.info("Aucun contrôle de santé enregistré.")
+        else:
+            icones = {"OK": "✅", "ERREUR": "❌", "NON_VERIFIE": "➖"}
+            health_rows = []
+            for doc_id in CLIENTS_CONFIG:
+                result = health_results.get(doc_id)
+                if not result:
+                    continue
+                checked_at = result.get("checked_at")
+                health_rows.append({
+                    "Client": result.get("client_name", doc_id),
+                    "Auth": icones.get(result.get("auth"), "➖"), "Société": icones.get(result.get("societe"), "➖"),
+                    "Journal": icones.get(result.get("journal"), "➖"), "Comptes": icones.get(result.get("comptes"), "➖"),
+                    "Vérifié le (UTC)": checked_at.strftime('%Y-%m-%d %H:%M') if checked_at else "N/A",
+                    "Détail": result.get("detail", ""),
                 })
-            st.dataframe(pd.DataFrame(clients_list), use_container_width=True)
+            st.dataframe(pd.DataFrame(health_rows), use_container_width=True, hide_index=True)
 
 
     # --- Onglet 3: Import Manuel ---
-    with tab_manual_import:
+    @st.fragment
+    def onglet_import():
+        with st.spinner("Chargement de la configuration..."):
+            SILAE_CONFIG = load_silae_secrets()
+            CLIENTS_CONFIG = load_client_mappings()
+
         st.header("⚡ Forcer un import manuel")
         st.warning("Cette action est destinée au débogage ou aux imports urgents. L'import automatique s'exécute déjà selon le jour configuré pour chaque client.")
 
+        job_runner = get_job_runner()
+
         if not CLIENTS_CONFIG:
             st.error("Aucun client n'est configuré. Veuillez en ajouter un dans l'onglet 'Administration'.")
         elif not SILAE_CONFIG:
             st.error("Configuration Silae (Secrets) non chargée. L'import manuel est désactivé.")
         else:
             client_name_map = {cfg.get("nom", doc_id): doc_id for doc_id, cfg in CLIENTS_CONFIG.items()}
-            selected_name = st.selectbox("1. Sélectionner un client", client_name_map.keys())
+            mode_import = st.radio("Mode d'import", ["Période unique", "Plage de périodes (backfill)"], horizontal=True, key="manual_mode")
+
+            def clients_importables(noms):
+                """Vérifie la configuration des clients sélectionnés, affiche les erreurs et retourne les valides."""
+                valides = []
+                for nom in noms:
+                    client_doc_id = client_name_map[nom]
+                    client_config = CLIENTS_CONFIG[client_doc_id]
+                    client_name = client_config.get("nom", client_doc_id)
+                    if not client_config.get("numero_dossier_silae"):
+                        st.error(f"Client {client_name} n'a pas de 'numero_dossier_silae' configuré.")
+                    elif not client_config.get("odoo_company_id"):
+                        st.error(f"Client {client_name} n'a pas d'ID de société Odoo configuré. Veuillez le configurer dans l'onglet Admin.")
+                    else:
+                        valides.append((client_doc_id, client_config, client_name))
+                return valides
+
+            force_refresh = st.checkbox("Forcer un nouvel appel Silae (ignorer le cache local des réponses)", key="manual_force_refresh",
+                                        help=f"Par défaut, une réponse Silae de moins de {SILAE_CACHE_TTL_HEURES:g} h pour le même dossier et la même période est rejouée.")
 
-            st.write("2. Sélectionner la période à importer")
             today = datetime.now()
-            col1, col2 = st.columns(2)
-            with col1:
-                month = st.selectbox("Mois", range(1, 13), index=today.month - 1, key="manual_month")
-            with col2:
-                year = st.number_input("Année", 2020, 2030, value=today.year, key="manual_year")
-
-            date_debut = datetime(year, month, 1)
-            date_fin = (date_debut + pd.DateOffset(months=1) - pd.DateOffset(days=1))
-            period_str = date_debut.strftime('%Y-%m')
-            st.write(f"Période cible : **{period_str}**")
-
-            if st.button(f"Lancer l'import pour {selected_name} (Période: {period_str})"):
-                client_doc_id = client_name_map[selected_name]
-                client_config = CLIENTS_CONFIG[client_doc_id]
-                client_name = client_config.get("nom", client_doc_id)
-                silae_dossier = client_config.get("numero_dossier_silae")
-
-                if not silae_dossier:
-                    st.error(f"Client {client_name} n'a pas de 'numero_dossier_silae' configuré.")
-                elif not client_config.get("odoo_company_id"):
-                    st.error(f"Client {client_name} n'a pas d'ID de société Odoo configuré. Veuillez le configurer dans l'onglet Admin.")
+            if mode_import == "Plage de périodes (backfill)":
+                if st.session_state.get("backfill_client") not in client_name_map: # Client renommé ou supprimé depuis la sélection
+                    st.session_state.pop("backfill_client", None)
+                selected_name = st.selectbox("1. Sélectionner un client", client_name_map.keys(), key="backfill_client")
+
+                st.write("2. Sélectionner la plage de périodes à importer")
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    month_from = st.selectbox("Mois de début", range(1, 13), key="backfill_month_from", **defaut_widget("backfill_month_from", index=today.month - 1))
+                with col2:
+                    year_from = st.number_input("Année de début", 2020, 2030, key="backfill_year_from", **defaut_widget("backfill_year_from", value=today.year - 1))
+                with col3:
+                    month_to = st.selectbox("Mois de fin", range(1, 13), key="backfill_month_to", **defaut_widget("backfill_month_to", index=today.month - 1))
+                with col4:
+                    year_to = st.number_input("Année de fin", 2020, 2030, key="backfill_year_to", **defaut_widget("backfill_year_to", value=today.year))
+
+                backfill_debut = datetime(year_from, month_from, 1)
+                backfill_fin = datetime(year_to, month_to, 1) + pd.DateOffset(months=1) - pd.DateOffset(days=1)
+                periodes = iter_periodes(backfill_debut, backfill_fin)
+
+                if not periodes:
+                    st.error("La période de fin doit être postérieure à la période de début.")
                 else:
-                    try:
-                        with st.spinner("Étape 1/4 : Obtention du token Silae..."):
-                            # --- MODIFIÉ : Passe SILAE_CONFIG ---
-                            silae_token = get_silae_token_manual(SILAE_CONFIG)
-                        if silae_token:
-                            with st.spinner(f"Étape 2/4 : Récupération des écritures Silae pour {client_name} (Période: {period_str})..."):
-                                # --- MODIFIÉ : Passe SILAE_CONFIG ---
-                                ecritures_silae = get_silae_ecritures_manual(silae_token, silae_dossier, date_debut, date_fin, SILAE_CONFIG)
-                            if ecritures_silae:
-                                with st.spinner("Étape 3/4 : Tentative d'import Odoo..."):
-                                    status, message = import_to_odoo_auto(client_config, ecritures_silae, period_str)
-                                st.subheader("Résultat de l'import :")
-                                if status.startswith("SUCCESS"):
-                                    st.success(message)
-                                else:
-                                    st.error(f"Erreur d'import : {message}")
-                                with st.spinner("Étape 4/4 : Enregistrement du log..."):
-                                    log_execution(client_doc_id, client_name, period_str, f"MANUAL_{status}", message)
-                                st.balloons()
-                                st.info("L'import manuel est terminé. Le journal des exécutions a été mis à jour.")
-                                get_execution_logs.clear()
-                            else:
-                                st.error(f"Aucune écriture Silae trouvée pour {client_name} (Période: {period_str}).")
-                                log_execution(client_doc_id, client_name, period_str, "MANUAL_ERROR_NO_DATA", "Aucune écriture Silae trouvée.")
-                    except Exception as e:
-                        st.error(f"Une erreur imprévue est survenue lors de l'import manuel : {e}")
-                        log_execution(client_doc_id, client_name, period_str, f"MANUAL_ERROR_FUNCTION ({type(e).__name__})", str(e))
\ No newline at end of file
+                    st.write(f"Plage cible : **{periodes[0][0]} ➔ {periodes[-1][0]}** ({len(periodes)} période(s))")
+                    if st.button(f"Lancer le backfill pour {selected_name} ({len(periodes)} période(s))"):
+                        for client_doc_id, client_config, client_name in clients_importables([selected_name]):
+                            job_runner.submit("Backfill", client_doc_id, client_name, f"{periodes[0][0]} ➔ {periodes[-1][0]}", len(periodes),
+                                              run_backfill_job, client_doc_id, client_config, backfill_debut, backfill_fin, SILAE_CONFIG, force_refresh)
+                            st.toast(f"Backfill lancé en arrière-plan pour {client_name}.")
+
+            else:
+                if "manual_clients" in st.session_state: # Sélection conservée : sans les clients renommés ou supprimés depuis
+                    st.session_state.manual_clients = [nom for nom in st.session_state.manual_clients if nom in client_name_map]
+                selected_names = st.multiselect("1. Sélectionner un ou plusieurs clients", list(client_name_map.keys()), key="manual_clients")
+
+                st.write("2. Sélectionner la période à importer")
+                col1, col2 = st.columns(2)
+                with col1:
+                    month = st.selectbox("Mois", range(1, 13), key="manual_month", **defaut_widget("manual_month", index=today.month - 1))
+                with col2:
+                    year = st.number_input("Année", 2020, 2030, key="manual_year", **defaut_widget("manual_year", value=today.year))
+
+                date_debut = datetime(year, month, 1)
+                date_fin = (date_debut + pd.DateOffset(months=1) - pd.DateOffset(days=1))
+                period_str = date_debut.strftime('%Y-%m')
+                st.write(f"Période cible : **{period_str}**")
+
+                if st.button(f"Lancer l'import pour {len(selected_names)} client(s) (Période: {period_str})", disabled=not selected_names):
+                    for client_doc_id, client_config, client_name in clients_importables(selected_names):
+                        job_runner.submit("Import", client_doc_id, client_name, period_str, len(JobProgressHook.LIBELLES),
+                                          run_manual_import_job, client_doc_id, client_config, date_debut, date_fin, SILAE_CONFIG, force_refresh)
+                        st.toast(f"Import lancé en arrière-plan pour {client_name} ({period_str}).")
+
+        st.divider()
+
+        # Polling des jobs : seul ce fragment est ré-exécuté tant que des imports sont en cours.
+        def afficher_jobs():
+            st.subheader("Imports en arrière-plan")
+            jobs = job_runner.jobs()
+            if not jobs:
+                st.info("Aucun import lancé depuis le démarrage de l'application.")
+                return
+            st.dataframe(
+                pd.DataFrame([job.as_row() for job in jobs]),
+                column_config={"Avancement": st.column_config.ProgressColumn("Avancement", min_value=0, max_value=100, format="%d%%")},
+                use_container_width=True, hide_index=True,
+            )
+            if st.session_state.get("jobs_polling") and not job_runner.has_active():
+                # Dernier rafraîchissement complet pour arrêter le polling et recharger les logs.
+                st.session_state.jobs_polling = False
+                st.rerun()
+
+        st.session_state.jobs_polling = job_runner.has_active()
+        st.fragment(run_every=2 if st.session_state.jobs_polling else None)(afficher_jobs)()
+
+    if onglet_actif == ONGLETS[0]:
+        onglet_logs()
+    elif onglet_actif == ONGLETS[1]:
+        onglet_admin()
+    else:
+        onglet_import()
@@ -0,0 +1,24 @@
+"""
+Cœur partagé de PayFlow (Silae ➔ Odoo), utilisé par l'application Streamlit
+(`payflow/app.py`) et par la Cloud Function (`payflow_function/main.py`).
+"""
+
+from .archive import (EXPORT_FORMATS, LOGS_ARCHIVE_URI, LOGS_ARCHIVE_URI_CONFIGUREE, LOGS_RETENTION_JOURS, compact_logs, export_logs,
+                      iter_log_pages, read_archived_logs)
+from .backfill import run_backfill
+from .directory import ClientIndex, normaliser
+from .gcp import get_project_id, load_silae_secrets
+from .health import HEALTH_COLLECTION, check_client_health, health_ok, run_health_check
+from .lease import LEASES_COLLECTION, LeaseHook, acquire_lease
+from .logs import LOGS_COLLECTION, log_execution
+from .metrics import REGISTRY, cache_hit_ratio, record_cache, start_metrics_server, write_metrics
+from .odoo import (OdooMetadataCache, OdooSession, credentials_key, fetch_odoo_metadata, odoo_fingerprint, odoo_urls,
+                   validate_odoo_config)
+from .pipeline import (STAGES, ImportContext, ImportPipeline, MetricsHook, PipelineHook, TimingHook,
+                       import_to_odoo_auto)
+from .planner import SLOTS_COLLECTION, build_execution_plan, get_due_clients, plan_execution_slots, replan_client
+from .profiling import PROFILES_COLLECTION, ProfilingHook, profiling_enabled
+from .silae import (clear_silae_token_cache, ecritures_vides, get_silae_ecritures, get_silae_token, iter_periodes,
+                    previous_month_period, split_ecritures_par_periode)
+from .silae_cache import SILAE_CACHE_TTL_HEURES, silae_cache_get, silae_cache_put
+from .warmup import WARMUP_COLLECTION, load_warmups, prepare_odoo_client, save_warmup
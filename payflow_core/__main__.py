@@ -0,0 +1,7 @@
+"""Point d'entrée `python -m payflow_core` (voir cli.py)."""
+
+import sys
+
+from .cli import main
+
+sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Archivage des logs : les entrées de payflow_logs plus anciennes que
+PAYFLOW_LOGS_RETENTION_JOURS sont déplacées dans des fichiers Parquet compressés,
+partitionnés par mois d'exécution (`{archive}/mois=AAAA-MM/*.parquet`), puis
+supprimées de Firestore par lots.
+
+L'emplacement PAYFLOW_LOGS_ARCHIVE_URI est un chemin local ou une URI gs://
+(système de fichiers pyarrow). La compaction supprimant les logs de Firestore,
+elle refuse de s'exécuter si cet emplacement n'est pas configuré explicitement
+(le défaut /tmp ne survit pas à une instance Cloud Functions).
+
+`export_logs` produit un export CSV/Parquet (audit) d'une plage de dates, mois par
+mois et page par page (archives puis Firestore), sans charger toute la plage en mémoire.
+"""
+
+import json
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from .logs import LOGS_COLLECTION
+from .silae import iter_periodes
+
+LOGS_ARCHIVE_URI = os.environ.get("PAYFLOW_LOGS_ARCHIVE_URI", "/tmp/payflow_logs_archive")
+LOGS_ARCHIVE_URI_CONFIGUREE = os.environ.get("PAYFLOW_LOGS_ARCHIVE_URI") # None : compaction refusée sans --archive-uri
+LOGS_RETENTION_JOURS = int(os.environ.get("PAYFLOW_LOGS_RETENTION_JOURS", "90"))
+
+# Colonnes fixes des archives ; les autres champs du log (durees_ms, profil_id...) sont regroupés en JSON dans `extra`.
+ARCHIVE_COLUMNS = ("log_id", "client_doc_id", "client_name", "period", "execution_time", "status", "message", "extra")
+ARCHIVE_SCHEMA = pa.schema([(c, pa.timestamp("us", tz="UTC") if c == "execution_time" else pa.string()) for c in ARCHIVE_COLUMNS])
+
+def _filesystem(archive_uri):
+    if "://" not in archive_uri:
+        archive_uri = os.path.abspath(archive_uri)
+    return pafs.FileSystem.from_uri(archive_uri)
+
+def _archive_row(doc):
+    data = doc.to_dict()
+    row = {"log_id": doc.id}
+    for champ in ARCHIVE_COLUMNS[1:-1]:
+        valeur = data.pop(champ, None)
+        row[champ] = valeur if champ == "execution_time" or valeur is None else str(valeur)
+    row["extra"] = json.dumps(data, ensure_ascii=False, default=str) if data else None
+    return row
+
+def _write_partition(fs, base, mois, rows):
+    dossier = f"{base}/mois={mois}"
+    fs.create_dir(dossier, recursive=True)
+    chemin = f"{dossier}/part-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}.parquet"
+    table = pa.Table.from_pandas(pd.DataFrame(rows, columns=ARCHIVE_COLUMNS), schema=ARCHIVE_SCHEMA, preserve_index=False)
+    pq.write_table(table, chemin, filesystem=fs, compression="zstd")
+    return chemin
+
+def compact_logs(db, retention_jours=LOGS_RETENTION_JOURS, archive_uri=LOGS_ARCHIVE_URI_CONFIGUREE, page_size=2000):
+    """
+    Archive puis supprime les logs plus anciens que `retention_jours`, page par page
+    (une page est écrite en Parquet avant d'être supprimée : un arrêt en cours de
+    route peut dupliquer une page dans l'archive, jamais la perdre).
+    Lève ValueError si aucun emplacement d'archive n'est configuré explicitement.
+    Retourne {mois: nombre de logs archivés}.
+    """
+    if not archive_uri:
+        raise ValueError("Emplacement des archives non configuré (PAYFLOW_LOGS_ARCHIVE_URI ou --archive-uri) : "
+                         "compaction refusée, les logs supprimés de Firestore seraient perdus.")
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_jours)
+    fs, base = _filesystem(archive_uri)
+    bilan = {}
+    while True:
+        query = db.collection(LOGS_COLLECTION).where("execution_time", "<", cutoff).order_by("execution_time").limit(page_size)
+        docs = list(query.stream())
+        if not docs:
+            break
+
+        par_mois = {}
+        for doc in docs:
+            row = _archive_row(doc)
+            par_mois.setdefault(row["execution_time"].strftime("%Y-%m"), []).append(row)
+        for mois, rows in par_mois.items():
+            _write_partition(fs, base, mois, rows)
+            bilan[mois] = bilan.get(mois, 0) + len(rows)
+
+        for i in range(0, len(docs), 500): # Limite Firestore : 500 écritures par batch
+            batch = db.batch()
+            for doc in docs[i:i + 500]:
+                batch.delete(doc.reference)
+            batch.commit()
+        print(f"  {len(docs)} logs archivés ({', '.join(sorted(par_mois))}).")
+        if len(docs) < page_size:
+            break
+    return bilan
+
+def read_archived_logs(date_debut, date_fin, archive_uri=LOGS_ARCHIVE_URI, client_doc_id=None, status=None):
+    """Logs archivés exécutés entre deux dates incluses (plus récents d'abord), filtrables par client et statut."""
+    fs, base = _filesystem(archive_uri)
+    filtres = [(champ, "==", valeur) for champ, valeur in (("client_doc_id", client_doc_id), ("status", status)) if valeur]
+    tables = []
+    for mois, _, _ in iter_periodes(date_debut, date_fin):
+        fichiers = fs.get_file_info(pafs.FileSelector(f"{base}/mois={mois}", allow_not_found=True))
+        for info in sorted(fichiers, key=lambda f: f.path):
+            if info.type == pafs.FileType.File and info.path.endswith(".parquet"):
+                tables.append(pq.read_table(info.path, filesystem=fs, schema=ARCHIVE_SCHEMA, filters=filtres or None))
+    if not tables:
+        return ARCHIVE_SCHEMA.empty_table().to_pandas() # Colonnes typées (execution_time reste un datetime)
+
+    df = pa.concat_tables(tables).to_pandas()
+    debut = pd.Timestamp(date_debut).tz_localize("UTC")
+    fin = pd.Timestamp(date_fin).tz_localize("UTC") + pd.Timedelta(days=1)
+    df = df[(df["execution_time"] >= debut) & (df["execution_time"] < fin)]
+    return df.drop_duplicates("log_id").sort_values("execution_time", ascending=False).reset_index(drop=True)
+
+# --- Export (audit) ---
+
+EXPORT_FORMATS = ("csv", "parquet")
+
+def iter_log_pages(db, debut, fin, client_doc_id=None, status=None, page_size=1000):
+    """Pages de logs Firestore (lignes au format archive) exécutés dans [debut, fin[, lues par curseur."""
+    query = db.collection(LOGS_COLLECTION).where("execution_time", ">=", debut).where("execution_time", "<", fin)
+    if client_doc_id:
+        query = query.where("client_doc_id", "==", client_doc_id)
+    if status:
+        query = query.where("status", "==", status)
+    query = query.order_by("execution_time").limit(page_size)
+    dernier = None
+    while True:
+        page = list((query.start_after(dernier) if dernier is not None else query).stream())
+        if not page:
+            return
+        yield [_archive_row(doc) for doc in page]
+        if len(page) < page_size:
+            return
+        dernier = page[-1]
+
+
+class _ExportWriter:
+    """Écrit un export page par page (en-tête CSV ou schéma Parquet fixé à l'ouverture)."""
+
+    def __init__(self, path, fmt):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Format d'export inconnu: {fmt} (attendu: {', '.join(EXPORT_FORMATS)}).")
+        self.fmt = fmt
+        self.lignes = 0
+        if fmt == "parquet":
+            self._writer = pq.ParquetWriter(path, ARCHIVE_SCHEMA, compression="zstd")
+        else:
+            self._file = open(path, "w", encoding="utf-8", newline="")
+            pd.DataFrame(columns=ARCHIVE_COLUMNS).to_csv(self._file, index=False)
+
+    def write(self, df):
+        if df.empty:
+            return
+        df = df.reindex(columns=ARCHIVE_COLUMNS)
+        if self.fmt == "parquet":
+            self._writer.write_table(pa.Table.from_pandas(df, schema=ARCHIVE_SCHEMA, preserve_index=False))
+        else:
+            df.to_csv(self._file, header=False, index=False)
+        self.lignes += len(df)
+
+    def close(self):
+        if self.fmt == "parquet":
+            self._writer.close()
+        else:
+            self._file.close()
+
+def _as_datetime(valeur):
+    """datetime.date (ex: st.date_input) ➔ datetime à minuit ; un datetime est retourné tel quel."""
+    return valeur if isinstance(valeur, datetime) else datetime.combine(valeur, datetime.min.time())
+
+def export_logs(db, path, fmt, date_debut, date_fin, client_doc_id=None, status=None, include_archives=True,
+                archive_uri=LOGS_ARCHIVE_URI, page_size=1000, progress_callback=None):
+    """
+    Exporte en CSV ou Parquet les logs exécutés entre deux dates incluses (archives
+    puis Firestore, mois par mois, du plus ancien au plus récent). La mémoire
+    utilisée est bornée par une page Firestore ou un mois d'archive.
+    `progress_callback(mois_traites, nb_mois, lignes)` est appelé après chaque mois.
+    Retourne le nombre de lignes exportées.
+    """
+    date_debut, date_fin = _as_datetime(date_debut), _as_datetime(date_fin)
+    debut_global = datetime(date_debut.year, date_debut.month, date_debut.day, tzinfo=timezone.utc)
+    fin_global = datetime(date_fin.year, date_fin.month, date_fin.day, tzinfo=timezone.utc) + timedelta(days=1)
+    mois = iter_periodes(date_debut, date_fin)
+    writer = _ExportWriter(path, fmt)
+    try:
+        for i, (_, debut_mois, fin_mois) in enumerate(mois, start=1):
+            debut = max(debut_global, datetime(debut_mois.year, debut_mois.month, 1, tzinfo=timezone.utc))
+            fin = min(fin_global, datetime(fin_mois.year, fin_mois.month, fin_mois.day, tzinfo=timezone.utc) + timedelta(days=1))
+            if include_archives:
+                archives = read_archived_logs(debut.replace(tzinfo=None), (fin - timedelta(days=1)).replace(tzinfo=None),
+                                              archive_uri=archive_uri, client_doc_id=client_doc_id, status=status)
+                writer.write(archives.sort_values("execution_time"))
+            for page in iter_log_pages(db, debut, fin, client_doc_id=client_doc_id, status=status, page_size=page_size):
+                writer.write(pd.DataFrame(page, columns=ARCHIVE_COLUMNS))
+            if progress_callback:
+                progress_callback(i, len(mois), writer.lignes)
+    finally:
+        writer.close()
+    return writer.lignes
@@ -0,0 +1,85 @@
+"""Backfill multi-périodes : un appel Silae pour la plage, imports Odoo parallèles sur une session partagée."""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .metrics import RETRIES
+from .lease import LeaseHook
+from .odoo import OdooSession
+from .pipeline import ImportContext, ImportPipeline
+from .profiling import ProfilingHook
+from .silae import get_silae_ecritures, get_silae_token, iter_periodes, split_ecritures_par_periode
+
+def run_backfill(db, client_doc_id, client_config, date_debut, date_fin, silae_config, progress_callback=None,
+                 max_workers=4, force_refresh=False, pipeline=None):
+    """
+    Importe toutes les périodes d'une plage pour un client : un seul token, un
+    seul appel Silae pour la plage (découpé par période), une seule
+    authentification Odoo partagée par les imports lancés en parallèle.
+    `progress_callback(period_str, status, message)` est appelé à chaque période terminée.
+    Retourne {period_str: (status, message)}.
+    """
+    pipeline = pipeline or ImportPipeline(db=db, status_prefix="BACKFILL_", hooks=[LeaseHook(db), ProfilingHook(db)])
+    client_name = client_config.get("nom", client_doc_id)
+    silae_dossier = client_config.get("numero_dossier_silae")
+    periodes = iter_periodes(date_debut, date_fin)
+    period_strs = [p for p, _, _ in periodes]
+    resultats = {}
+
+    def terminer(ctx):
+        status, message = pipeline.run(ctx)
+        resultats[ctx.period_str] = (status, message)
+        if progress_callback:
+            progress_callback(ctx.period_str, status, message)
+
+    silae_token = get_silae_token(silae_config)
+
+    def fetch_ou_none(debut, fin):
+        try:
+            return get_silae_ecritures(silae_token, silae_config, silae_dossier, debut, fin, force_refresh=force_refresh)
+        except Exception as e:
+            print(f"ERREUR Silae (Backfill {client_name}, {debut:%Y-%m} ➔ {fin:%Y-%m}): {e}")
+            return None
+
+    ecritures_plage = fetch_ou_none(periodes[0][1], periodes[-1][2])
+    ecritures_par_periode = split_ecritures_par_periode(ecritures_plage, period_strs) if ecritures_plage else None
+    if ecritures_par_periode is None:
+        # Réponse non découpable : un appel par période, toujours avec le même token.
+        RETRIES.inc(operation="silae_ecritures_par_periode")
+        ecritures_par_periode = {p: fetch_ou_none(debut, fin) for p, debut, fin in periodes}
+
+    contextes = []
+    for period_str, debut, fin in periodes:
+        # Pièce datée de la fin de sa période (pas du jour du rattrapage), référence propre à la période.
+        ctx = ImportContext(client_doc_id, client_config, period_str, debut, fin, silae_config, silae_token,
+                            ecritures=ecritures_par_periode.get(period_str), force_refresh=force_refresh,
+                            move_date=fin, ref_avec_periode=True)
+        if ctx.ecritures is None:
+            ctx.finish("ERROR_SILAE", "Échec de la récupération des écritures Silae pour cette période.")
+        contextes.append(ctx)
+
+    a_importer = [ctx for ctx in contextes if not ctx.status and ctx.ecritures.get('ruptures')]
+    for ctx in contextes:
+        if ctx not in a_importer:
+            terminer(ctx) # Erreur Silae ou période sans données : seul le log est écrit
+    if not a_importer:
+        return resultats
+
+    try:
+        session = OdooSession(client_config)
+    except Exception as e:
+        for ctx in a_importer:
+            ctx.finish("ERROR_ODOO_RPC", f"Connexion Odoo impossible: {e}")
+            terminer(ctx)
+        return resultats
+
+    for ctx in a_importer:
+        ctx.session = session
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(pipeline.run, ctx): ctx for ctx in a_importer}
+        for future in as_completed(futures):
+            ctx = futures[future]
+            status, message = future.result() # pipeline.run ne lève pas d'exception
+            resultats[ctx.period_str] = (status, message)
+            if progress_callback:
+                progress_callback(ctx.period_str, status, message)
+    return resultats
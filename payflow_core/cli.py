@@ -0,0 +1,251 @@
+"""
+Exécution en ligne de commande (poste local ou VM), sans contexte Pub/Sub ni
+limite de durée Cloud Functions.
+
+    python -m payflow_core run --day 5 --workers 8
+    python -m payflow_core run --clients 1234,5678 --from 2024-01 --to 2024-12 --dry-run --summary resume.json
+    python -m payflow_core compact --days 90 --archive-uri gs://bucket/payflow_logs
+    python -m payflow_core health --verifier-comptes --summary sante.json
+"""
+
+import argparse
+import calendar
+import cProfile
+import json
+import pstats
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from .archive import LOGS_ARCHIVE_URI_CONFIGUREE, LOGS_RETENTION_JOURS, compact_logs
+from .backfill import run_backfill
+from .gcp import get_project_id, load_silae_secrets
+from .health import health_ok, run_health_check
+from .lease import LeaseHook
+from .metrics import start_metrics_server, write_metrics
+from .pipeline import ImportContext, ImportPipeline, MetricsHook, PipelineHook, TimingHook
+from .planner import get_due_clients
+from .profiling import ProfilingHook
+from .silae import get_silae_token, iter_periodes, previous_month_period
+from .warmup import load_warmups
+
+def _parse_mois(valeur):
+    try:
+        return datetime.strptime(valeur, "%Y-%m")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Période invalide '{valeur}' (format attendu: AAAA-MM).")
+
+def dry_run_create_stage(pipeline, ctx):
+    """Remplace l'étape create en --dry-run : tout est résolu, rien n'est écrit dans Odoo."""
+    ctx.finish("DRY_RUN", f"{len(ctx.lignes)} lignes prêtes (journal ID {ctx.journal_id}), pièce non créée.")
+
+
+class SummaryHook(PipelineHook):
+    """Collecte le résultat et les durées de chaque import pour le résumé JSON."""
+
+    def __init__(self):
+        self.rows = []
+        self._lock = threading.Lock()
+
+    def add(self, client_doc_id, client_name, period_str, status, message, durees_ms=None):
+        with self._lock:
+            self.rows.append({"client_doc_id": client_doc_id, "client_name": client_name, "period": period_str,
+                              "status": status, "message": message, "durees_ms": durees_ms or {}})
+
+    def after_stage(self, stage, ctx, elapsed):
+        if stage == "log":
+            self.add(ctx.client_doc_id, ctx.client_name, ctx.period_str, ctx.status, ctx.message,
+                     {s: round(t * 1000) for s, t in ctx.timings.items()})
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m payflow_core", description="PayFlow - imports Silae ➔ Odoo en lot.")
+    sub = parser.add_subparsers(dest="commande", required=True)
+
+    run = sub.add_parser("run", help="Lance les imports d'un jour, d'une liste de clients et/ou d'une plage de périodes.")
+    run.add_argument("--day", type=int, help="Jour du mois dont les clients planifiés sont traités (défaut : aujourd'hui). Ignoré avec --clients.")
+    run.add_argument("--clients", help="Liste d'ID de documents clients séparés par des virgules.")
+    run.add_argument("--period", type=_parse_mois, help="Période unique AAAA-MM (défaut : mois précédent).")
+    run.add_argument("--from", dest="period_from", type=_parse_mois, help="Début de plage AAAA-MM (backfill).")
+    run.add_argument("--to", dest="period_to", type=_parse_mois, help="Fin de plage AAAA-MM (défaut : --from).")
+    run.add_argument("--workers", type=int, default=4, help="Nombre de clients traités en parallèle (défaut : 4).")
+    run.add_argument("--dry-run", action="store_true", help="Résout tout mais ne crée aucune pièce Odoo et n'écrit aucun log.")
+    run.add_argument("--force-refresh", action="store_true", help="Ignore le cache local des réponses Silae.")
+    run.add_argument("--profile", action="store_true", help="Profile l'exécution (cProfile, fusionné sur tous les workers).")
+    run.add_argument("--profile-output", default=None, help="Fichier .pstats du profil (défaut : payflow_profile_<horodatage>.pstats).")
+    run.add_argument("--metrics-port", type=int, help="Sert les métriques Prometheus sur ce port (/metrics) pendant l'exécution.")
+    run.add_argument("--metrics-file", help="Écrit les métriques Prometheus dans ce fichier en fin d'exécution.")
+    run.add_argument("--summary", default="-", help="Fichier du résumé JSON ('-' = sortie standard).")
+    run.add_argument("--database", default="payflow-db", help="Base Firestore (défaut : payflow-db).")
+    run.set_defaults(func=run_command)
+
+    compact = sub.add_parser("compact", help="Archive en Parquet puis supprime les logs anciens de payflow_logs.")
+    compact.add_argument("--days", type=int, default=LOGS_RETENTION_JOURS, help=f"Ancienneté minimale (jours) des logs archivés (défaut : {LOGS_RETENTION_JOURS}).")
+    compact.add_argument("--archive-uri", default=LOGS_ARCHIVE_URI_CONFIGUREE, help="Emplacement des archives, chemin local ou gs:// (défaut : PAYFLOW_LOGS_ARCHIVE_URI, obligatoire).")
+    compact.add_argument("--database", default="payflow-db", help="Base Firestore (défaut : payflow-db).")
+    compact.set_defaults(func=compact_command)
+
+    health = sub.add_parser("health", help="Contrôle la connexion Odoo (et les comptes) de tous les clients, résultats dans payflow_health.")
+    health.add_argument("--clients", help="Liste d'ID de documents clients séparés par des virgules (défaut : tous).")
+    health.add_argument("--verifier-comptes", action="store_true", help="Vérifie aussi les comptes de la dernière paie (1 appel Silae par client).")
+    health.add_argument("--workers", type=int, default=8, help="Nombre de clients contrôlés en parallèle (défaut : 8).")
+    health.add_argument("--summary", default="-", help="Fichier du résumé JSON ('-' = sortie standard).")
+    health.add_argument("--database", default="payflow-db", help="Base Firestore (défaut : payflow-db).")
+    health.set_defaults(func=health_command)
+    return parser
+
+def _load_clients(db, args, reference):
+    if args.clients:
+        ids = [c.strip() for c in args.clients.split(",") if c.strip()]
+        snaps = db.get_all([db.collection("payflow_clients").document(doc_id) for doc_id in ids])
+        docs = [snap for snap in snaps if snap.exists]
+        manquants = set(ids) - {doc.id for doc in docs}
+        if manquants:
+            print(f"AVERTISSEMENT: Clients introuvables: {sorted(manquants)}", file=sys.stderr)
+        return docs
+    return get_due_clients(db, reference, toutes_fenetres=True, enregistrer_plan=not args.dry_run)
+
+def run_command(args):
+    from google.cloud import firestore, secretmanager # Dépendances GCP chargées à l'exécution seulement
+
+    started_at = today = datetime.utcnow()
+    reference = today.replace(day=min(args.day, calendar.monthrange(today.year, today.month)[1])) if args.day else today
+
+    if args.period_from:
+        periodes = iter_periodes(args.period_from, args.period_to or args.period_from)
+        if not periodes:
+            print("ERREUR: --to doit être postérieur à --from.", file=sys.stderr)
+            return 2
+    elif args.period:
+        periodes = iter_periodes(args.period, args.period)
+    else:
+        date_debut, date_fin, period_str = previous_month_period(reference)
+        periodes = [(period_str, date_debut, date_fin)]
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+        print(f"Métriques servies sur http://0.0.0.0:{args.metrics_port}/metrics", file=sys.stderr)
+
+    db = firestore.Client(database=args.database)
+    silae_config = load_silae_secrets(secretmanager.SecretManagerServiceClient(), get_project_id())
+    client_docs = _load_clients(db, args, reference)
+    print(f"{len(client_docs)} client(s), {len(periodes)} période(s) ({periodes[0][0]} ➔ {periodes[-1][0]}), {args.workers} worker(s){' [DRY-RUN]' if args.dry_run else ''}.", file=sys.stderr)
+
+    summary_hook = SummaryHook()
+    pipeline = ImportPipeline(db=None if args.dry_run else db, status_prefix="CLI_", hooks=[TimingHook(), MetricsHook(), summary_hook])
+    if not args.dry_run:
+        pipeline.hooks.insert(0, LeaseHook(db))
+    if not args.profile: # Un seul cProfile actif par thread : --profile remplace le profilage par client
+        pipeline.add_hook(ProfilingHook(None if args.dry_run else db))
+    if args.dry_run:
+        pipeline.stages["create"] = dry_run_create_stage
+
+    get_silae_token(silae_config) # Échec immédiat si les identifiants Silae sont invalides ; le token n'est pas figé dans les contextes
+    warmups = load_warmups(db, client_docs) if len(periodes) == 1 else {}
+    profils = []
+    profils_lock = threading.Lock()
+
+    def traiter(doc):
+        profil = cProfile.Profile() if args.profile else None
+        if profil:
+            profil.enable()
+        try:
+            client_config = doc.to_dict()
+            if len(periodes) == 1:
+                period_str, date_debut, date_fin = periodes[0]
+                # Sans token fourni, fetch le demande à get_silae_token (cache renouvelé avant expiration) : lots de plus d'une heure.
+                ctx = ImportContext(doc.id, client_config, period_str, date_debut, date_fin, silae_config,
+                                    warmup=warmups.get(doc.id), force_refresh=args.force_refresh)
+                pipeline.run(ctx)
+            else:
+                run_backfill(db, doc.id, client_config, periodes[0][1], periodes[-1][2], silae_config,
+                             force_refresh=args.force_refresh, pipeline=pipeline)
+        except Exception as e:
+            print(f"ERREUR (Client {doc.id}): {e}", file=sys.stderr)
+            summary_hook.add(doc.id, doc.id, None, "ERROR_FUNCTION", f"Erreur fonctionnelle: {e}")
+        finally:
+            if profil:
+                profil.disable()
+                with profils_lock:
+                    profils.append(profil)
+
+    debut = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(args.workers, 1)) as executor:
+        list(executor.map(traiter, client_docs))
+    duree = time.perf_counter() - debut
+
+    totaux = {}
+    for row in summary_hook.rows:
+        totaux[row["status"]] = totaux.get(row["status"], 0) + 1
+    summary = {
+        "started_at": started_at.isoformat() + "Z", "duration_s": round(duree, 3), "dry_run": args.dry_run,
+        "periods": [p for p, _, _ in periodes], "clients": len(client_docs), "workers": args.workers,
+        "totals": totaux, "results": sorted(summary_hook.rows, key=lambda r: (r["client_doc_id"], r["period"] or "")),
+    }
+
+    if profils:
+        profile_output = args.profile_output or f"payflow_profile_{started_at:%Y%m%dT%H%M%S}.pstats"
+        stats = pstats.Stats(profils[0])
+        for profil in profils[1:]:
+            stats.add(profil)
+        stats.dump_stats(profile_output)
+        summary["profile"] = profile_output
+        stats.stream = sys.stderr
+        stats.sort_stats("cumulative").print_stats(25)
+
+    if args.metrics_file:
+        write_metrics(args.metrics_file)
+        summary["metrics"] = args.metrics_file
+
+    contenu = json.dumps(summary, ensure_ascii=False, indent=2, default=str)
+    if args.summary == "-":
+        print(contenu)
+    else:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            f.write(contenu)
+        print(f"Résumé écrit dans {args.summary}", file=sys.stderr)
+
+    ok = all(status.startswith(("SUCCESS", "SKIPPED")) or status == "DRY_RUN" for status in totaux)
+    return 0 if ok else 1
+
+def compact_command(args):
+    if not args.archive_uri:
+        print("ERREUR: --archive-uri (ou PAYFLOW_LOGS_ARCHIVE_URI) est obligatoire : les logs archivés sont supprimés de Firestore.", file=sys.stderr)
+        return 2
+    from google.cloud import firestore
+
+    bilan = compact_logs(firestore.Client(database=args.database), retention_jours=args.days, archive_uri=args.archive_uri)
+    print(json.dumps({"archive_uri": args.archive_uri, "archived": sum(bilan.values()), "par_mois": bilan}, ensure_ascii=False, indent=2))
+    return 0
+
+def health_command(args):
+    from google.cloud import firestore, secretmanager
+
+    db = firestore.Client(database=args.database)
+    if args.clients:
+        ids = [c.strip() for c in args.clients.split(",") if c.strip()]
+        snaps = db.get_all([db.collection("payflow_clients").document(doc_id) for doc_id in ids])
+    else:
+        snaps = db.collection("payflow_clients").stream()
+    clients_config = {snap.id: snap.to_dict() for snap in snaps if snap.exists}
+    silae_config = load_silae_secrets(secretmanager.SecretManagerServiceClient(), get_project_id()) if args.verifier_comptes else None
+    print(f"Contrôle de santé de {len(clients_config)} client(s){' (avec comptes)' if args.verifier_comptes else ''}...", file=sys.stderr)
+
+    results = run_health_check(db, clients_config, silae_config, verifier_comptes=args.verifier_comptes, max_workers=args.workers,
+                               progress_callback=lambda n, total: print(f"  {n}/{total}", file=sys.stderr) if n % 25 == 0 or n == total else None)
+    erreurs = [r for r in results if not health_ok(r)]
+    contenu = json.dumps({"clients": len(results), "erreurs": len(erreurs), "resultats": sorted(results, key=lambda r: (health_ok(r), r["client_name"]))},
+                         ensure_ascii=False, indent=2, default=str)
+    if args.summary == "-":
+        print(contenu)
+    else:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            f.write(contenu)
+        print(f"Résumé écrit dans {args.summary}", file=sys.stderr)
+    return 1 if erreurs else 0
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
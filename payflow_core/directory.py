@@ -0,0 +1,88 @@
+"""
+Annuaire des clients : index en mémoire pour la recherche par préfixe sur le nom,
+le numéro de dossier Silae, l'hôte Odoo et le journal de paie.
+
+L'index est construit une fois par version de la configuration (payflow_clients)
+puis interrogé à chaque interaction (recherche dichotomique, sans parcourir tous
+les clients).
+"""
+
+import bisect
+import re
+import unicodedata
+
+CHAMPS_INDEXES = ("nom", "numero_dossier_silae", "odoo_host", "journal_paie_odoo")
+
+def normaliser(texte):
+    """Minuscules sans accents (la recherche 'societe' trouve 'Société')."""
+    texte = unicodedata.normalize("NFKD", str(texte or ""))
+    return "".join(c for c in texte if not unicodedata.combining(c)).lower().strip()
+
+def _tokens(valeur):
+    """La valeur entière et chacun de ses mots ('acme.odoo.com' -> acme.odoo.com, acme, odoo, com)."""
+    valeur = normaliser(valeur)
+    if not valeur:
+        return set()
+    return {valeur} | {mot for mot in re.split(r"[^0-9a-z]+", valeur) if mot}
+
+
+class ClientIndex:
+    """Index des clients trié par nom, interrogeable par préfixes (tous les termes doivent correspondre)."""
+
+    def __init__(self, clients_config):
+        self.clients_config = clients_config
+        self.doc_ids = sorted(clients_config, key=lambda doc_id: (normaliser(clients_config[doc_id].get("nom", doc_id)), doc_id))
+        self._rangs = {doc_id: rang for rang, doc_id in enumerate(self.doc_ids)}
+        entrees = set()
+        for doc_id, rang in self._rangs.items():
+            cfg = dict(clients_config[doc_id], numero_dossier_silae=clients_config[doc_id].get("numero_dossier_silae") or doc_id)
+            for champ in CHAMPS_INDEXES:
+                entrees.update((token, rang) for token in _tokens(cfg.get(champ)))
+        self._entrees = sorted(entrees)
+        self._rows = {}
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def _rangs_prefixe(self, terme):
+        rangs = set()
+        i = bisect.bisect_left(self._entrees, (terme, -1))
+        while i < len(self._entrees) and self._entrees[i][0].startswith(terme):
+            rangs.add(self._entrees[i][1])
+            i += 1
+        return rangs
+
+    def search(self, query):
+        """ID des clients dont chaque terme de `query` préfixe un des champs indexés (tous si vide), triés par nom."""
+        termes = normaliser(query).split()
+        if not termes:
+            return list(self.doc_ids)
+        rangs = None
+        for terme in termes:
+            rangs = self._rangs_prefixe(terme) if rangs is None else rangs & self._rangs_prefixe(terme)
+            if not rangs:
+                return []
+        return [self.doc_ids[rang] for rang in sorted(rangs)]
+
+    def page(self, query, page=1, page_size=25):
+        """Retourne (ID de la page demandée, nombre total de résultats)."""
+        resultats = self.search(query)
+        debut = (max(page, 1) - 1) * page_size
+        return resultats[debut:debut + page_size], len(resultats)
+
+    def label(self, doc_id):
+        return f"{self.clients_config[doc_id].get('nom', doc_id)} ({doc_id})"
+
+    def row(self, doc_id):
+        """Ligne d'affichage du client (construite une seule fois)."""
+        if doc_id not in self._rows:
+            config = self.clients_config[doc_id]
+            self._rows[doc_id] = {
+                "ID Document (N° Silae)": doc_id, "Nom Client": config.get("nom", "N/A"),
+                "Jour Transfert": config.get("jour_transfert", "N/A"),
+                "Hôte Odoo": config.get("odoo_host", "N/A"),
+                "Base Odoo": config.get("database_odoo", "N/A"),
+                "Journal Paie Odoo": config.get("journal_paie_odoo", "N/A"),
+                "ID Société Odoo": config.get("odoo_company_id", "Non concerné"),
+            }
+        return self._rows[doc_id]
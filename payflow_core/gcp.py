@@ -0,0 +1,24 @@
+"""Accès aux ressources GCP partagées (projet, Secret Manager)."""
+
+import os
+
+SILAE_SECRETS = ["SILAE_CLIENT_ID", "SILAE_CLIENT_SECRET", "SILAE_SUBSCRIPTION_KEY"]
+
+def get_project_id():
+    """Retourne l'ID du projet GCP (GCP_PROJECT ou GCLOUD_PROJECT), ou None."""
+    return os.environ.get("GCP_PROJECT") or os.environ.get("GCLOUD_PROJECT")
+
+def access_secret(secret_client, project_id, key):
+    """Lit la dernière version d'un secret (texte nettoyé)."""
+    name = f"projects/{project_id}/secrets/{key}/versions/latest"
+    response = secret_client.access_secret_version(request={"name": name})
+    return response.payload.data.decode("UTF-8").strip()
+
+def load_silae_secrets(secret_client, project_id):
+    """Charge les secrets Silae depuis Secret Manager ({client_id, client_secret, subscription_key})."""
+    if not secret_client or not project_id:
+        raise Exception("Client Secret Manager non initialisé ou PROJECT_ID manquant.")
+    config = {key.split('_', 1)[-1].lower(): access_secret(secret_client, project_id, key) for key in SILAE_SECRETS}
+    if not all(config.get(k) for k in ['client_id', 'client_secret', 'subscription_key']):
+        raise ValueError("Un ou plusieurs secrets Silae sont manquants.")
+    return config
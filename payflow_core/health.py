@@ -0,0 +1,102 @@
+"""Contrôle de santé des connexions Odoo de tous les clients."""
+
+import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from .odoo import OdooSession
+from .silae import get_silae_ecritures, get_silae_token, previous_month_period
+from .silae_cache import silae_cache_get
+
+HEALTH_COLLECTION = "payflow_health"
+
+def check_client_health(client_doc_id, client_config, silae_token=None, silae_config=None, date_debut=None, date_fin=None):
+    """
+    Vérifie un client : authentification Odoo, accès à la société, existence du
+    journal et, si un token Silae est fourni, couverture des comptes de la
+    dernière paie (réponse en cache si disponible).
+    """
+    result = {
+        "client_doc_id": client_doc_id, "client_name": client_config.get("nom", client_doc_id),
+        "auth": "NON_VERIFIE", "societe": "NON_VERIFIE", "journal": "NON_VERIFIE", "comptes": "NON_VERIFIE",
+        "detail": "", "checked_at": datetime.utcnow(),
+    }
+    details = []
+    try:
+        if not all(client_config.get(k) for k in ('odoo_host', 'database_odoo', 'odoo_login', 'odoo_password', 'journal_paie_odoo', 'odoo_company_id')):
+            result["auth"] = "ERREUR"
+            details.append("Configuration Odoo incomplète.")
+            return result
+
+        session = OdooSession(client_config)
+        result["auth"] = "OK"
+
+        company_id = client_config.get('odoo_company_id')
+        user_data = session.execute('res.users', 'read', [session.uid], ['company_ids'])
+        if company_id in (user_data[0].get('company_ids') or []):
+            result["societe"] = "OK"
+        else:
+            result["societe"] = "ERREUR"
+            details.append(f"Société ID {company_id} non accessible pour cet utilisateur.")
+
+        if session.resolve_journal():
+            result["journal"] = "OK"
+        else:
+            result["journal"] = "ERREUR"
+            details.append(f"Journal '{client_config.get('journal_paie_odoo')}' introuvable.")
+
+        if silae_token and client_config.get("numero_dossier_silae"):
+            # Dernière réponse Silae connue (cache, sans limite d'âge), sinon appel Silae.
+            ecritures = silae_cache_get(client_config["numero_dossier_silae"], date_debut, date_fin, max_age_heures=None)
+            if ecritures is None:
+                ecritures = get_silae_ecritures(silae_token, silae_config, client_config["numero_dossier_silae"], date_debut, date_fin)
+            ruptures = (ecritures or {}).get('ruptures') or []
+            codes = {ligne['compte'] for ligne in (ruptures[0].get('ecritures') or [])} if ruptures else set()
+            if not codes:
+                details.append(f"Pas d'écritures Silae pour {date_debut:%Y-%m}, comptes non vérifiés.")
+            else:
+                _, comptes_manquants = session.resolve_accounts(codes)
+                if comptes_manquants:
+                    result["comptes"] = "ERREUR"
+                    details.append(f"Comptes introuvables: {sorted(comptes_manquants)}.")
+                else:
+                    result["comptes"] = "OK"
+    except xmlrpc.client.Fault as e:
+        details.append(f"Erreur Odoo (Fault): {e.faultString}")
+    except Exception as e:
+        if result["auth"] == "NON_VERIFIE":
+            result["auth"] = "ERREUR"
+        details.append(str(e))
+    finally:
+        result["detail"] = " ".join(details)[:1500]
+    return result
+
+def run_health_check(db, clients_config, silae_config=None, verifier_comptes=False, max_workers=8, progress_callback=None):
+    """
+    Contrôle tous les clients en parallèle et enregistre les résultats horodatés dans Firestore.
+    `progress_callback(clients_controles, nb_clients)` est appelé après chaque client.
+    """
+    silae_token = None
+    date_debut = date_fin = None
+    if verifier_comptes:
+        silae_token = get_silae_token(silae_config)
+        date_debut, date_fin, _ = previous_month_period(datetime.now())
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(check_client_health, doc_id, cfg, silae_token, silae_config, date_debut, date_fin) for doc_id, cfg in clients_config.items()]
+        results = []
+        for future in as_completed(futures):
+            results.append(future.result())
+            if progress_callback:
+                progress_callback(len(results), len(futures))
+
+    for i in range(0, len(results), 500): # Limite Firestore par batch
+        batch = db.batch()
+        for result in results[i:i + 500]:
+            batch.set(db.collection(HEALTH_COLLECTION).document(result["client_doc_id"]), result)
+        batch.commit()
+    return results
+
+def health_ok(result):
+    """Vrai si aucun contrôle du client n'est en erreur."""
+    return "ERREUR" not in (result.get(k) for k in ("auth", "societe", "journal", "comptes"))
@@ -0,0 +1,200 @@
+"""
+Bail (lease) Firestore par (client, période) : un seul worker importe un client
+pour une période donnée, même si Cloud Scheduler se chevauche ou si Pub/Sub
+livre deux fois le même message.
+
+Le bail expire après PAYFLOW_LEASE_TTL_SECONDES sans heartbeat (worker mort) et
+peut alors être repris. Les écritures sont conditionnées par `update_time`
+(précondition Firestore) : deux workers ne peuvent pas prendre le même bail.
+
+Une fois la pièce Odoo créée, le bail n'est pas supprimé mais marqué terminé
+(`state: done`) pendant PAYFLOW_LEASE_DONE_TTL_SECONDES : une livraison Pub/Sub
+tardive, arrivée après la fin du premier worker, ne crée pas de seconde pièce.
+"""
+
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from google.api_core.exceptions import AlreadyExists, Conflict, FailedPrecondition
+
+from .pipeline import PipelineHook
+
+LEASES_COLLECTION = "payflow_leases"
+LEASE_TTL_SECONDES = int(os.environ.get("PAYFLOW_LEASE_TTL_SECONDES", "300"))
+LEASE_DONE_TTL_SECONDES = int(os.environ.get("PAYFLOW_LEASE_DONE_TTL_SECONDES", str(7 * 24 * 3600))) # Rétention max. Pub/Sub
+LEASE_DONE = "done"
+
+def default_owner():
+    """Identifiant du worker courant (hôte, pid, jeton aléatoire)."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class Lease:
+    """Bail détenu sur (client, période). Prolongé par un heartbeat tant qu'il n'est pas libéré."""
+
+    def __init__(self, db, doc_ref, owner, update_time, ttl):
+        self.db = db
+        self.doc_ref = doc_ref
+        self.owner = owner
+        self.ttl = ttl
+        self.lost = False
+        self._update_time = update_time
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat_loop, name=f"lease-{doc_ref.id}", daemon=True)
+        self._thread.start()
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(max(self.ttl / 3, 1)):
+            if not self.heartbeat():
+                return
+
+    def heartbeat(self):
+        """Repousse l'expiration. Retourne False (et marque le bail perdu) si un autre worker l'a repris."""
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            try:
+                result = self.doc_ref.update({"expires_at": now + timedelta(seconds=self.ttl), "heartbeat_at": now},
+                                             option=self.db.write_option(last_update_time=self._update_time))
+                self._update_time = result.update_time
+                return True
+            except Exception as e:
+                print(f"AVERTISSEMENT: Bail {self.doc_ref.id} perdu (heartbeat refusé): {e}")
+                self.lost = True
+                return False
+
+    def release(self):
+        """Arrête le heartbeat et supprime le bail s'il nous appartient toujours."""
+        self._stop.set()
+        self._thread.join(timeout=5)
+        with self._lock:
+            if self.lost:
+                return
+            try:
+                self.doc_ref.delete(option=self.db.write_option(last_update_time=self._update_time))
+            except Exception as e:
+                print(f"AVERTISSEMENT: Bail {self.doc_ref.id} non libéré (expirera seul): {e}")
+
+    def complete(self, done_ttl=LEASE_DONE_TTL_SECONDES):
+        """Arrête le heartbeat et marque (client, période) comme traité pendant `done_ttl` secondes."""
+        self._stop.set()
+        self._thread.join(timeout=5)
+        with self._lock:
+            if self.lost:
+                return
+            now = datetime.now(timezone.utc)
+            try:
+                self.doc_ref.update({"state": LEASE_DONE, "completed_at": now, "expires_at": now + timedelta(seconds=done_ttl)},
+                                    option=self.db.write_option(last_update_time=self._update_time))
+            except Exception as e:
+                print(f"AVERTISSEMENT: Bail {self.doc_ref.id} non marqué terminé (expirera seul): {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def _acquire(db, client_doc_id, period_str, owner, ttl, respecter_termine):
+    """Retourne (Lease, None) ou (None, raison) avec raison 'en_cours' ou 'termine'."""
+    doc_ref = db.collection(LEASES_COLLECTION).document(f"{client_doc_id}_{period_str}")
+    now = datetime.now(timezone.utc)
+    data = {"client_doc_id": client_doc_id, "period": period_str, "owner": owner, "state": "running",
+            "acquired_at": now, "heartbeat_at": now, "expires_at": now + timedelta(seconds=ttl)}
+    try:
+        result = doc_ref.create(data) # Échoue si le document existe déjà
+        return Lease(db, doc_ref, owner, result.update_time, ttl), None
+    except (AlreadyExists, Conflict):
+        pass
+
+    snap = doc_ref.get()
+    if snap.exists:
+        courant = snap.to_dict() or {}
+        expires_at = courant.get("expires_at")
+        termine = courant.get("state") == LEASE_DONE
+        if expires_at and expires_at > now and (respecter_termine or not termine):
+            if termine:
+                print(f"  {doc_ref.id} déjà importé par {courant.get('owner')} (marqueur jusqu'au {expires_at:%d/%m %H:%M} UTC).")
+                return None, "termine"
+            print(f"  Bail {doc_ref.id} détenu par {courant.get('owner')} jusqu'à {expires_at:%H:%M:%S} UTC.")
+            return None, "en_cours"
+    try:
+        if snap.exists: # Bail expiré (ou marqueur ignoré) : reprise conditionnée à la version lue
+            result = doc_ref.update(data, option=db.write_option(last_update_time=snap.update_time))
+        else: # Libéré entre-temps
+            result = doc_ref.create(data)
+    except (AlreadyExists, Conflict, FailedPrecondition) as e:
+        print(f"  Bail {doc_ref.id} pris par un autre worker: {e}")
+        return None, "en_cours"
+    return Lease(db, doc_ref, owner, result.update_time, ttl), None
+
+def acquire_lease(db, client_doc_id, period_str, owner=None, ttl=LEASE_TTL_SECONDES, respecter_termine=True):
+    """
+    Prend le bail (client, période). Retourne un Lease, ou None si un autre worker le
+    détient ou si la période a déjà été importée (marqueur `done` non expiré, sauf
+    si `respecter_termine` est faux).
+    """
+    return _acquire(db, client_doc_id, period_str, owner or default_owner(), ttl, respecter_termine)[0]
+
+
+class LeaseHook(PipelineHook):
+    """
+    Prend le bail (client, période) avant fetch et le libère après log. Sans bail,
+    l'import est abandonné immédiatement (SKIPPED_LEASE, sans appel Silae/Odoo ni log).
+    Si une pièce a été créée, le bail est marqué terminé pendant `done_ttl` secondes
+    au lieu d'être supprimé. Avec `forcer=True` (import manuel forcé), un marqueur
+    existant est ignoré à la prise du bail ; la pièce créée laisse son propre marqueur.
+    À placer en premier dans la liste des hooks.
+    """
+
+    def __init__(self, db, owner=None, ttl=LEASE_TTL_SECONDES, done_ttl=LEASE_DONE_TTL_SECONDES, forcer=False):
+        self.db = db
+        self.owner = owner or default_owner()
+        self.ttl = ttl
+        self.done_ttl = done_ttl
+        self.forcer = forcer
+        self._leases = {} # id(ctx) -> Lease
+        self._lock = threading.Lock()
+
+    def _skip(self, ctx, message):
+        ctx.finish("SKIPPED_LEASE", message)
+        ctx.skip_log = True
+        print(f"  Client {ctx.client_name} ({ctx.period_str}) ignoré : {message}")
+        return True
+
+    def before_stage(self, stage, ctx):
+        if stage == "fetch":
+            lease, raison = _acquire(self.db, ctx.client_doc_id, ctx.period_str, self.owner, self.ttl, not self.forcer)
+            if lease is None:
+                if raison == "termine":
+                    return self._skip(ctx, "Période déjà importée pour ce client (livraison en double).")
+                return self._skip(ctx, "Import déjà en cours sur un autre worker pour ce client et cette période.")
+            with self._lock:
+                self._leases[id(ctx)] = lease
+        elif stage == "create":
+            with self._lock:
+                lease = self._leases.get(id(ctx))
+            if lease and lease.lost: # Un autre worker a repris le bail : ne pas créer la pièce en double
+                return self._skip(ctx, "Bail perdu avant la création de la pièce (repris par un autre worker).")
+        return False
+
+    def after_stage(self, stage, ctx, elapsed):
+        if stage == "log":
+            self._release(ctx, termine=ctx.move_id is not None)
+
+    def on_error(self, stage, ctx, exc):
+        if stage == "log":
+            self._release(ctx, termine=ctx.move_id is not None)
+
+    def _release(self, ctx, termine=False):
+        with self._lock:
+            lease = self._leases.pop(id(ctx), None)
+        if lease:
+            if termine:
+                lease.complete(self.done_ttl)
+            else:
+                lease.release()
@@ -0,0 +1,29 @@
+"""Journal des exécutions (collection payflow_logs)."""
+
+from datetime import datetime
+
+LOGS_COLLECTION = "payflow_logs"
+
+def log_execution(db, client_doc_id, client_name, period_str, status, message, extra=None):
+    """Enregistre le résultat dans la collection payflow_logs de Firestore. Retourne True si écrit."""
+    if not db:
+        print(f"ERREUR: Client Firestore non dispo, log non enregistré pour {client_doc_id}")
+        return False
+    try:
+        log_entry = {
+            "client_doc_id": client_doc_id,
+            "client_name": client_name,
+            "period": period_str,
+            "execution_time": datetime.utcnow(),
+            "status": status,
+            "message": message[:1500]
+        }
+        if extra:
+            log_entry.update(extra)
+        log_doc_id = f"{client_doc_id}_{period_str}_{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}"
+        db.collection(LOGS_COLLECTION).document(log_doc_id).set(log_entry)
+        print(f"Log enregistré pour {client_name} - Période: {period_str} - Statut: {status}")
+        return True
+    except Exception as e:
+        print(f"ERREUR: Échec d'écriture du log Firestore pour {client_doc_id}: {e}")
+        return False
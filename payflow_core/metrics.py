@@ -0,0 +1,187 @@
+"""
+Métriques d'exploitation au format texte Prometheus (sans dépendance externe).
+
+Les compteurs et histogrammes sont alimentés par le pipeline
+(pipeline.MetricsHook) et par les clients Silae/Odoo. En mode CLI/VM, ils sont
+servis en HTTP (`start_metrics_server`, endpoint /metrics) ou écrits dans un
+fichier en fin d'exécution (`write_metrics`, compatible textfile collector de node_exporter).
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LIGNES_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _format_labels(noms, valeurs, extra=()):
+    paires = list(zip(noms, valeurs)) + list(extra)
+    if not paires:
+        return ""
+    echappe = lambda v: str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{n}="{echappe(v)}"' for n, v in paires) + "}"
+
+def _format_nombre(valeur):
+    if valeur == float("inf"):
+        return "+Inf"
+    return repr(float(valeur)) if isinstance(valeur, float) else str(valeur)
+
+
+class Counter:
+    """Compteur monotone, par combinaison de labels (échantillons et métadonnées nommés `<name>_total`)."""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._valeurs = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        cle = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._valeurs[cle] = self._valeurs.get(cle, 0) + amount
+
+    @property
+    def sample_name(self):
+        return f"{self.name}_total"
+
+    def value(self, **labels):
+        with self._lock:
+            return self._valeurs.get(tuple(str(labels.get(n, "")) for n in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            valeurs = dict(self._valeurs)
+        return [(self.sample_name, _format_labels(self.labelnames, cle), v) for cle, v in sorted(valeurs.items())]
+
+
+class Histogram:
+    """Histogramme à buckets cumulés, par combinaison de labels."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCE_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.sample_name = name
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {} # labels -> [comptes par bucket, somme, nombre]
+        self._lock = threading.Lock()
+
+    def observe(self, valeur, **labels):
+        cle = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            comptes, somme, nombre = self._series.get(cle) or ([0] * len(self.buckets), 0.0, 0)
+            for i, borne in enumerate(self.buckets):
+                if valeur <= borne:
+                    comptes[i] += 1
+            self._series[cle] = (comptes, somme + valeur, nombre + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        debut = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - debut, **labels)
+
+    def samples(self):
+        with self._lock:
+            series = {cle: (list(c), s, n) for cle, (c, s, n) in self._series.items()}
+        lignes = []
+        for cle, (comptes, somme, nombre) in sorted(series.items()):
+            for borne, compte in zip(self.buckets, comptes):
+                lignes.append((f"{self.name}_bucket", _format_labels(self.labelnames, cle, [("le", _format_nombre(borne))]), compte))
+            lignes.append((f"{self.name}_sum", _format_labels(self.labelnames, cle), somme))
+            lignes.append((f"{self.name}_count", _format_labels(self.labelnames, cle), nombre))
+        return lignes
+
+
+class MetricsRegistry:
+    """Ensemble des métriques d'un processus, rendu au format texte Prometheus."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCE_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lignes = []
+        for metric in metrics:
+            # Format texte 0.0.4 : HELP/TYPE nomment l'échantillon (payflow_imports_total), sinon la série est ingérée comme untyped.
+            lignes.append(f"# HELP {metric.sample_name} {metric.documentation}")
+            lignes.append(f"# TYPE {metric.sample_name} {metric.type}")
+            lignes.extend(f"{nom}{labels} {_format_nombre(valeur)}" for nom, labels, valeur in metric.samples())
+        return "\n".join(lignes) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+IMPORTS = REGISTRY.counter("payflow_imports", "Imports terminés, par statut.", ("status",))
+STAGE_SECONDS = REGISTRY.histogram("payflow_stage_seconds", "Durée des étapes du pipeline.", ("stage",))
+SILAE_SECONDS = REGISTRY.histogram("payflow_silae_request_seconds", "Latence des appels HTTP Silae.", ("endpoint",))
+ODOO_SECONDS = REGISTRY.histogram("payflow_odoo_request_seconds", "Latence des appels XML-RPC Odoo.", ("method",))
+LIGNES_PAR_PIECE = REGISTRY.histogram("payflow_move_lines", "Nombre de lignes par pièce Odoo créée.", (), LIGNES_BUCKETS)
+RETRIES = REGISTRY.counter("payflow_retries", "Appels relancés après un premier échec ou une réponse inexploitable.", ("operation",))
+CACHE = REGISTRY.counter("payflow_cache_requests", "Consultations des caches (token, comptes, session...), par résultat hit/miss.", ("cache", "result"))
+
+def record_cache(cache, hit, count=1):
+    """Compte `count` consultations du cache `cache` (hit ou miss)."""
+    if count:
+        CACHE.inc(count, cache=cache, result="hit" if hit else "miss")
+
+def cache_hit_ratio(cache):
+    """Part des consultations servies par le cache (None si aucune consultation)."""
+    hits, misses = CACHE.value(cache=cache, result="hit"), CACHE.value(cache=cache, result="miss")
+    return hits / (hits + misses) if hits + misses else None
+
+
+# --- Exposition ---
+
+def write_metrics(path, registry=REGISTRY):
+    """Écrit les métriques dans `path` (remplacement atomique, lisible par le textfile collector)."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    os.replace(tmp, path)
+
+def start_metrics_server(port, host="0.0.0.0", registry=REGISTRY):
+    """Sert /metrics dans un thread démon. Retourne le serveur (`shutdown()` pour l'arrêter)."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            corps = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(corps)))
+            self.end_headers()
+            self.wfile.write(corps)
+
+        def log_message(self, format, *args):
+            pass # Pas de log par requête de scrape
+
+    serveur = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=serveur.serve_forever, name="payflow-metrics", daemon=True).start()
+    return serveur
@@ -0,0 +1,181 @@
+"""Connexion Odoo (XML-RPC) : session authentifiée réutilisable et résolutions mises en cache."""
+
+import hashlib
+import threading
+import time
+import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import ODOO_SECONDS, record_cache
+
+def odoo_urls(host):
+    """Retourne (url_common, url_object) selon le type d'hébergement Odoo."""
+    if ".odoo.com" in host:
+        return f"https://{host}/xmlrpc/common", f"https://{host}/xmlrpc/object"
+    return f"https://{host}/xmlrpc/2/common", f"https://{host}/xmlrpc/2/object"
+
+def odoo_fingerprint(client_config):
+    """Empreinte de la connexion Odoo d'un client (invalide le warmup si la config change)."""
+    champs = ('odoo_host', 'database_odoo', 'odoo_login', 'odoo_password', 'journal_paie_odoo', 'odoo_company_id')
+    return hashlib.sha256("|".join(str(client_config.get(c, "")) for c in champs).encode()).hexdigest()
+
+def validate_odoo_config(client_config):
+    """Lève ValueError si la configuration Odoo du client est incomplète."""
+    champs = ('odoo_host', 'database_odoo', 'odoo_login', 'odoo_password', 'journal_paie_odoo')
+    if not all(client_config.get(c) for c in champs):
+        raise ValueError("Configuration Odoo manquante (host, db, login, password ou journal).")
+    if not client_config.get('odoo_company_id'):
+        raise ValueError(f"ID de société Odoo (odoo_company_id) manquant pour le client {client_config.get('nom')}. Veuillez reconfigurer le client dans PayFlow.")
+
+
+class OdooSession:
+    """
+    Session Odoo authentifiée une seule fois, réutilisable pour plusieurs imports
+    (thread-safe). Si `warmup` (voir warmup.prepare_odoo_client) correspond à la
+    configuration, l'authentification et les résolutions déjà connues sont sautées.
+    """
+
+    def __init__(self, client_config, warmup=None):
+        self.host = client_config.get('odoo_host')
+        self.db = client_config.get('database_odoo')
+        self.username = client_config.get('odoo_login')
+        self.password = client_config.get('odoo_password')
+        self.journal_code = client_config.get('journal_paie_odoo')
+        self.company_id = client_config.get('odoo_company_id')
+        url_common, self.url_object = odoo_urls(self.host)
+
+        self.context = {'allowed_company_ids': [self.company_id]} if self.company_id else {} # Sans société : contexte par défaut de l'utilisateur
+        self._local = threading.local() # ServerProxy n'est pas thread-safe : un proxy par thread
+        self._lock = threading.Lock()
+        self._account_ids = {}
+        self._journal_id = None
+        self.from_warmup = bool(warmup) and warmup.get("fingerprint") == odoo_fingerprint(client_config)
+        if warmup is not None: # Sessions sans warmup proposé (admin, métadonnées) : hors ratio
+            record_cache("odoo_warmup", self.from_warmup)
+
+        if self.from_warmup:
+            self.uid = warmup["uid"]
+            self._account_ids = dict(warmup.get("account_ids") or {})
+            self._journal_id = warmup.get("journal_id")
+        else:
+            common = xmlrpc.client.ServerProxy(url_common)
+            with ODOO_SECONDS.time(method="common.authenticate"):
+                self.uid = common.authenticate(self.db, self.username, self.password, {})
+            if not self.uid:
+                raise Exception("Échec d'authentification Odoo. Vérifiez login/clé API/base de données.")
+
+    def execute(self, model, method, *args, **kwargs):
+        models = getattr(self._local, 'models', None)
+        if models is None:
+            models = self._local.models = xmlrpc.client.ServerProxy(self.url_object)
+        kwargs.setdefault('context', {}).update(self.context)
+        with ODOO_SECONDS.time(method=f"{model}.{method}"):
+            return models.execute_kw(self.db, self.uid, self.password, model, method, args, kwargs)
+
+    def resolve_accounts(self, codes):
+        """Retourne (code -> id, codes manquants), en ne demandant à Odoo que les codes pas encore connus."""
+        with self._lock:
+            a_chercher = set(codes) - set(self._account_ids)
+        record_cache("odoo_accounts", True, len(set(codes)) - len(a_chercher))
+        record_cache("odoo_accounts", False, len(a_chercher))
+        if a_chercher:
+            account_data = self.execute('account.account', 'search_read', [('code', 'in', list(a_chercher))], fields=['code', 'id'])
+            with self._lock:
+                self._account_ids.update({acc['code']: acc['id'] for acc in account_data})
+        with self._lock:
+            code_to_id_map = {code: self._account_ids[code] for code in codes if code in self._account_ids}
+        return code_to_id_map, set(codes) - set(code_to_id_map)
+
+    def load_all_accounts(self):
+        """Charge tout le plan comptable de la société (code -> id)."""
+        accounts = self.execute('account.account', 'search_read', [], fields=['code', 'id'])
+        with self._lock:
+            self._account_ids.update({acc['code']: acc['id'] for acc in accounts if acc.get('code')})
+            return dict(self._account_ids)
+
+    def resolve_journal(self):
+        """Retourne l'ID du journal de paie (ou None), mis en cache pour la session."""
+        record_cache("odoo_journal", self._journal_id is not None)
+        if self._journal_id is None:
+            journal_id = self.execute('account.journal', 'search', [('code', '=', self.journal_code)], limit=1)
+            self._journal_id = journal_id[0] if journal_id else None
+        return self._journal_id
+
+
+# --- Métadonnées (sociétés et journaux) pour la configuration d'un client ---
+
+JOURNAL_TYPES_CONFIG = ['bank', 'cash', 'sale', 'purchase', 'general']
+
+def credentials_key(odoo_host, database_odoo, odoo_login, odoo_password):
+    """Clé de cache d'un jeu d'identifiants Odoo (le mot de passe n'est jamais stocké en clair)."""
+    return hashlib.sha256("|".join((odoo_host or "", database_odoo or "", odoo_login or "", odoo_password or "")).encode()).hexdigest()
+
+def fetch_odoo_metadata(odoo_host, database_odoo, odoo_login, odoo_password):
+    """
+    Sociétés accessibles ({id: nom}) et journaux ({code: libellé}) d'un utilisateur Odoo.
+    Une seule authentification ; les lectures sociétés et journaux partent en parallèle.
+    Lève une exception si la connexion ou la lecture échoue.
+    """
+    session = OdooSession({'odoo_host': odoo_host, 'database_odoo': database_odoo, 'odoo_login': odoo_login, 'odoo_password': odoo_password})
+
+    def lire_societes():
+        user = session.execute('res.users', 'read', [session.uid], ['company_ids', 'company_id'])[0]
+        company_ids = user.get('company_ids') or ([user['company_id'][0]] if user.get('company_id') else [])
+        companies_data = session.execute('res.company', 'search_read', [('id', 'in', company_ids)], fields=['name'], order="name")
+        return {c['id']: c['name'] for c in companies_data}
+
+    def lire_journaux():
+        journals_data = session.execute('account.journal', 'search_read', [('type', 'in', JOURNAL_TYPES_CONFIG)], fields=['code', 'name', 'company_id'], order="code")
+        return {j['code']: f"{j['code']} - {j['name']} ({j['company_id'][1] if j['company_id'] else 'N/A'})" for j in journals_data}
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futur_societes = executor.submit(lire_societes)
+        futur_journaux = executor.submit(lire_journaux)
+        return futur_societes.result(), futur_journaux.result()
+
+
+class OdooMetadataCache:
+    """
+    Cache des sociétés/journaux par jeu d'identifiants, partagé entre clients et
+    sessions. Chaque entrée expire après `ttl` secondes et s'invalide
+    individuellement (`invalidate`) sans toucher aux autres.
+    """
+
+    def __init__(self, ttl=600, fetch=fetch_odoo_metadata):
+        self.ttl = ttl
+        self._fetch = fetch
+        self._entrees = {} # clé -> (horodatage, sociétés, journaux)
+        self._verrous = {} # clé -> verrou : un seul chargement simultané par jeu d'identifiants
+        self._lock = threading.Lock()
+
+    def peek(self, odoo_host, database_odoo, odoo_login, odoo_password):
+        """(sociétés, journaux) si en cache et valides, sinon None. Ne contacte jamais Odoo."""
+        with self._lock:
+            entree = self._entrees.get(credentials_key(odoo_host, database_odoo, odoo_login, odoo_password))
+        if entree and time.monotonic() - entree[0] < self.ttl:
+            return entree[1], entree[2]
+        return None
+
+    def get(self, odoo_host, database_odoo, odoo_login, odoo_password, refresh=False):
+        """(sociétés, journaux) depuis le cache, ou chargés depuis Odoo (toujours si `refresh`). Lève en cas d'échec."""
+        cle = credentials_key(odoo_host, database_odoo, odoo_login, odoo_password)
+        with self._lock:
+            verrou = self._verrous.setdefault(cle, threading.Lock())
+        with verrou:
+            if not refresh:
+                cached = self.peek(odoo_host, database_odoo, odoo_login, odoo_password)
+                if cached is not None:
+                    return cached
+            societes, journaux = self._fetch(odoo_host, database_odoo, odoo_login, odoo_password)
+            with self._lock:
+                self._entrees[cle] = (time.monotonic(), societes, journaux)
+            return societes, journaux
+
+    def invalidate(self, odoo_host, database_odoo, odoo_login, odoo_password):
+        """Oublie l'entrée de ce jeu d'identifiants uniquement."""
+        with self._lock:
+            self._entrees.pop(credentials_key(odoo_host, database_odoo, odoo_login, odoo_password), None)
+
+    def clear(self):
+        with self._lock:
+            self._entrees.clear()
@@ -0,0 +1,241 @@
+"""
+Pipeline d'import Silae ➔ Odoo en étapes explicites :
+fetch → transform → resolve → create → log.
+
+Chaque étape est une fonction `etape(pipeline, ctx)` remplaçable via
+`pipeline.stages[nom]`. Les hooks (PipelineHook) sont appelés autour de chaque
+étape et peuvent la sauter (cache), partager un état entre imports (batching)
+ou mesurer sa durée.
+"""
+
+import threading
+import time
+import traceback
+import xmlrpc.client
+from datetime import datetime
+
+from .logs import log_execution
+from .metrics import IMPORTS, LIGNES_PAR_PIECE, STAGE_SECONDS, record_cache
+from .odoo import OdooSession, validate_odoo_config
+from .silae import ecritures_vides, get_silae_ecritures, get_silae_token
+
+STAGES = ("fetch", "transform", "resolve", "create", "log")
+
+_ACTIFS_LOCK = threading.Lock()
+_IMPORTS_ACTIFS = 0
+
+def imports_actifs():
+    """Nombre d'imports en cours dans le processus, tous pipelines confondus (ex: pour le profilage)."""
+    with _ACTIFS_LOCK:
+        return _IMPORTS_ACTIFS
+
+def _compter_import(delta):
+    global _IMPORTS_ACTIFS
+    with _ACTIFS_LOCK:
+        _IMPORTS_ACTIFS += delta
+
+
+class ImportContext:
+    """État d'un import (un client, une période), partagé par les étapes et les hooks."""
+
+    def __init__(self, client_doc_id, client_config, period_str, date_debut=None, date_fin=None,
+                 silae_config=None, silae_token=None, ecritures=None, session=None, warmup=None, force_refresh=False,
+                 move_date=None, ref_avec_periode=False):
+        self.client_doc_id = client_doc_id
+        self.client_config = client_config
+        self.client_name = client_config.get("nom", client_doc_id)
+        self.period_str = period_str
+        self.date_debut = date_debut
+        self.date_fin = date_fin
+        self.silae_config = silae_config
+        self.silae_token = silae_token
+        self.force_refresh = force_refresh
+        self.ecritures = ecritures # Préremplies (backfill, rejeu) : l'étape fetch ne rappelle pas Silae
+        self.session = session # OdooSession partagée entre plusieurs imports
+        self.warmup = warmup
+        self.move_date = move_date # Date comptable de la pièce (défaut : aujourd'hui) ; fin de période en backfill
+        self.ref_avec_periode = ref_avec_periode # Ajoute la période à la référence (plusieurs pièces issues d'une même rupture)
+        self.rupture = None
+        self.lignes = None
+        self.comptes = None
+        self.code_to_id_map = None
+        self.journal_id = None
+        self.move_id = None
+        self.status = None
+        self.message = None
+        self.timings = {} # Durée de chaque étape (secondes)
+        self.extra = {} # Champs ajoutés au log Firestore par les hooks
+        self.skip_log = False # Vrai : l'étape log s'exécute (hooks compris) sans écrire dans payflow_logs
+
+    def finish(self, status, message):
+        """Fixe le résultat : les étapes restantes (sauf log) ne sont pas exécutées."""
+        self.status = status
+        self.message = message
+
+
+class PipelineHook:
+    """Point d'extension du pipeline. Toutes les méthodes sont optionnelles."""
+
+    def before_stage(self, stage, ctx):
+        """Appelé avant une étape. Retourner True saute l'étape (ex: résultat fourni par un cache)."""
+        return False
+
+    def after_stage(self, stage, ctx, elapsed):
+        """Appelé après une étape réussie (`elapsed` en secondes)."""
+
+    def on_error(self, stage, ctx, exc):
+        """Appelé quand une étape lève une exception."""
+
+
+class TimingHook(PipelineHook):
+    """Ajoute la durée de chaque étape (ms) au log Firestore (`durees_ms`)."""
+
+    def before_stage(self, stage, ctx):
+        if stage == "log":
+            ctx.extra["durees_ms"] = {s: round(t * 1000) for s, t in ctx.timings.items()}
+        return False
+
+
+class MetricsHook(PipelineHook):
+    """Alimente les métriques d'import : durée des étapes, statut final, lignes par pièce."""
+
+    def after_stage(self, stage, ctx, elapsed):
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if stage == "create" and ctx.move_id:
+            LIGNES_PAR_PIECE.observe(len(ctx.lignes or []))
+        if stage == "log":
+            IMPORTS.inc(status=ctx.status)
+
+    def on_error(self, stage, ctx, exc):
+        if stage == "log":
+            IMPORTS.inc(status=ctx.status)
+
+
+# --- Étapes par défaut ---
+
+def fetch_stage(pipeline, ctx):
+    """Récupère les écritures Silae de la période (sauf si déjà fournies)."""
+    if ctx.ecritures is None:
+        silae_dossier = ctx.client_config.get("numero_dossier_silae")
+        if not silae_dossier:
+            ctx.finish("ERROR_CONFIG", "Dossier Silae non configuré dans Firestore.")
+            return
+        if not ctx.silae_token:
+            ctx.silae_token = get_silae_token(ctx.silae_config)
+        ctx.ecritures = get_silae_ecritures(ctx.silae_token, ctx.silae_config, silae_dossier, ctx.date_debut, ctx.date_fin, force_refresh=ctx.force_refresh)
+    if ecritures_vides(ctx.ecritures):
+        ctx.finish(pipeline.no_data_status, "Aucune écriture Silae trouvée pour cette période.")
+
+def transform_stage(pipeline, ctx):
+    """Convertit les lignes Silae en lignes débit/crédit et collecte les comptes à résoudre."""
+    ctx.rupture = ctx.ecritures['ruptures'][0]
+    lignes_silae = ctx.rupture.get('ecritures')
+    if not lignes_silae:
+        ctx.finish("SUCCESS_EMPTY", "Journal Silae vide, rien à importer.")
+        return
+    ctx.comptes = set()
+    ctx.lignes = []
+    for ligne in lignes_silae:
+        code_compte = ligne['compte']
+        ctx.lignes.append({'account_code': code_compte, 'name': ligne['libelle'], 'debit': ligne['valeur'] if ligne['sens'] == 'D' else 0.0, 'credit': ligne['valeur'] if ligne['sens'] == 'C' else 0.0})
+        ctx.comptes.add(code_compte)
+
+def resolve_stage(pipeline, ctx):
+    """Ouvre (ou réutilise) la session Odoo et résout comptes et journal."""
+    validate_odoo_config(ctx.client_config)
+    record_cache("odoo_session", ctx.session is not None)
+    if ctx.session is None:
+        ctx.session = OdooSession(ctx.client_config, warmup=ctx.warmup)
+    ctx.code_to_id_map, comptes_manquants = ctx.session.resolve_accounts(ctx.comptes)
+    if comptes_manquants:
+        ctx.finish("ERROR_ACCOUNT", f"Comptes Odoo introuvables: {sorted(list(comptes_manquants))}. Vérifiez la liaison Silae ET que la bonne société Odoo est sélectionnée.")
+        return
+    ctx.journal_id = ctx.session.resolve_journal()
+    if not ctx.journal_id:
+        ctx.finish("ERROR_JOURNAL", f"Journal Odoo introuvable (Code: '{ctx.client_config.get('journal_paie_odoo')}') dans la société ID {ctx.client_config.get('odoo_company_id')}. Vérifiez la config client.")
+
+def create_stage(pipeline, ctx):
+    """Crée la pièce comptable (brouillon) dans Odoo."""
+    lignes_finales = [(0, 0, {'account_id': ctx.code_to_id_map[ligne['account_code']], 'name': ligne['name'], 'debit': ligne['debit'], 'credit': ligne['credit']}) for ligne in ctx.lignes]
+    ref = ctx.rupture.get('libelle', f"Import Paie Silae {ctx.period_str}")
+    if ctx.ref_avec_periode and ctx.period_str not in ref:
+        ref = f"{ref} - {ctx.period_str}"
+    move_vals = {'journal_id': ctx.journal_id, 'ref': ref, 'date': (ctx.move_date or datetime.now()).strftime('%Y-%m-%d'), 'line_ids': lignes_finales}
+    ctx.move_id = ctx.session.execute('account.move', 'create', move_vals)
+    move_info = ctx.session.execute('account.move', 'read', [ctx.move_id], ['name'])
+    move_name = move_info[0].get('name') if move_info and move_info[0].get('name') else f"ID {ctx.move_id}"
+    ctx.finish("SUCCESS", f"Pièce créée (Brouillon): {move_name}")
+
+def log_stage(pipeline, ctx):
+    """Enregistre le résultat dans payflow_logs (ignoré sans client Firestore ou si `ctx.skip_log`)."""
+    if pipeline.db is not None and not ctx.skip_log:
+        log_execution(pipeline.db, ctx.client_doc_id, ctx.client_name, ctx.period_str, f"{pipeline.status_prefix}{ctx.status}", ctx.message, extra=ctx.extra or None)
+
+
+class ImportPipeline:
+    """Exécute les étapes d'un import et traduit les exceptions en statuts PayFlow."""
+
+    def __init__(self, db=None, status_prefix="", no_data_status="SUCCESS_NO_DATA", hooks=None):
+        self.db = db
+        self.status_prefix = status_prefix
+        self.no_data_status = no_data_status
+        self.hooks = list(hooks or [])
+        self.stages = {"fetch": fetch_stage, "transform": transform_stage, "resolve": resolve_stage, "create": create_stage, "log": log_stage}
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+        return hook
+
+    def run(self, ctx):
+        """Exécute le pipeline pour `ctx` et retourne (status, message). Ne lève pas d'exception."""
+        _compter_import(1)
+        try:
+            return self._run_stages(ctx)
+        finally:
+            _compter_import(-1)
+
+    def _run_stages(self, ctx):
+        for stage in STAGES[:-1]:
+            if ctx.status:
+                break
+            try:
+                self._run_stage(stage, ctx)
+            except xmlrpc.client.Fault as e:
+                print(f"ERREUR XML-RPC (Client: {ctx.client_name}): {e.faultString}")
+                ctx.finish("ERROR_ODOO_RPC", f"Erreur Odoo (Fault): {str(e)}")
+            except Exception as e:
+                print(f"ERREUR ({stage}, Client {ctx.client_name}): {e}")
+                traceback.print_exc()
+                if stage in ("resolve", "create") and not isinstance(e, ValueError):
+                    ctx.finish("ERROR_UNKNOWN", f"Erreur inattendue: {str(e)}")
+                else:
+                    ctx.finish("ERROR_FUNCTION", f"Erreur fonctionnelle: {e}")
+        try:
+            self._run_stage("log", ctx)
+        except Exception as e:
+            print(f"ERREUR: Étape log en échec pour {ctx.client_doc_id}: {e}")
+        return ctx.status, ctx.message
+
+    def _run_stage(self, stage, ctx):
+        skip = False
+        for hook in self.hooks:
+            skip = bool(hook.before_stage(stage, ctx)) or skip
+        if skip:
+            return
+        debut = time.perf_counter()
+        try:
+            self.stages[stage](self, ctx)
+        except Exception as e:
+            ctx.timings[stage] = time.perf_counter() - debut
+            for hook in self.hooks:
+                hook.on_error(stage, ctx, e)
+            raise
+        elapsed = ctx.timings[stage] = time.perf_counter() - debut
+        for hook in self.hooks:
+            hook.after_stage(stage, ctx, elapsed)
+
+
+def import_to_odoo_auto(client_config, ecritures_data, period_str, session=None, warmup=None):
+    """Importe des écritures déjà récupérées dans Odoo, sans log. Retourne (status, message)."""
+    ctx = ImportContext(client_config.get("numero_dossier_silae"), client_config, period_str, ecritures=ecritures_data, session=session, warmup=warmup)
+    return ImportPipeline().run(ctx)
@@ -0,0 +1,179 @@
+"""Planification des créneaux d'exécution (lissage de charge sur le mois)."""
+
+import calendar
+import os
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+SLOTS_COLLECTION = "payflow_slots"
+PLANNER_CAPACITE_CRENEAU = int(os.environ.get("PAYFLOW_CAPACITE_CRENEAU", "25"))
+PLANNER_TOLERANCE_JOURS = int(os.environ.get("PAYFLOW_TOLERANCE_JOURS", "2"))
+PLANNER_TIMEZONE = os.environ.get("PAYFLOW_TIMEZONE", "Europe/Paris")
+
+def parse_fenetres_horaires(valeur):
+    """Convertit "3-4,4-5" en [(3, 4), (4, 5)]."""
+    fenetres = []
+    for morceau in valeur.split(","):
+        morceau = morceau.strip()
+        if not morceau:
+            continue
+        debut, fin = (int(x) for x in morceau.split("-", 1))
+        if not 0 <= debut < fin <= 24:
+            raise ValueError(f"Fenêtre horaire invalide: '{morceau}'")
+        fenetres.append((debut, fin))
+    if not fenetres:
+        raise ValueError("Aucune fenêtre horaire configurée.")
+    return sorted(fenetres)
+
+# Une seule fenêtre par défaut : équivalent au déclenchement quotidien unique (3h).
+PLANNER_FENETRES_HORAIRES = parse_fenetres_horaires(os.environ.get("PAYFLOW_FENETRES_HORAIRES", "3-4"))
+
+def jour_effectif(jour_transfert, annee, mois):
+    """Ramène un jour de transfert impossible (29-31) au dernier jour du mois."""
+    dernier_jour = calendar.monthrange(annee, mois)[1]
+    try:
+        jour = int(jour_transfert)
+    except (TypeError, ValueError):
+        jour = 1
+    return min(max(jour, 1), dernier_jour)
+
+def plan_execution_slots(clients_config, annee, mois, capacite=None, tolerance=None, fenetres=None, charge_initiale=None):
+    """
+    Calcule un créneau (jour + fenêtre horaire) par client pour le mois donné.
+    Un client n'est jamais avancé avant son jour choisi : il peut être décalé
+    d'au plus `tolerance` jours (surchargeable par client via 'tolerance_jours')
+    pour ne pas dépasser `capacite` clients par créneau. Si tous les créneaux
+    autorisés sont pleins, le moins chargé est retenu. `charge_initiale`
+    ({(jour, (heure_debut, heure_fin)): nombre}) tient compte de créneaux déjà attribués.
+    """
+    capacite = capacite or PLANNER_CAPACITE_CRENEAU
+    tolerance = PLANNER_TOLERANCE_JOURS if tolerance is None else tolerance
+    fenetres = fenetres or PLANNER_FENETRES_HORAIRES
+    dernier_jour = calendar.monthrange(annee, mois)[1]
+
+    candidats_par_client = {}
+    for doc_id, cfg in clients_config.items():
+        jour_demande = jour_effectif(cfg.get("jour_transfert", 1), annee, mois)
+        tolerance_client = cfg.get("tolerance_jours", tolerance)
+        try:
+            tolerance_client = max(int(tolerance_client), 0)
+        except (TypeError, ValueError):
+            tolerance_client = tolerance
+        jours = range(jour_demande, min(jour_demande + tolerance_client, dernier_jour) + 1)
+        candidats_par_client[doc_id] = (jour_demande, [(j, f) for j in jours for f in fenetres])
+
+    # Les clients les plus contraints (moins de créneaux possibles) sont placés en premier.
+    ordre = sorted(candidats_par_client, key=lambda d: (len(candidats_par_client[d][1]), candidats_par_client[d][0], d))
+
+    charge = dict(charge_initiale or {})
+    plan = {}
+    for doc_id in ordre:
+        jour_demande, candidats = candidats_par_client[doc_id]
+        creneau = next((c for c in candidats if charge.get(c, 0) < capacite), None)
+        if creneau is None:
+            creneau = min(candidats, key=lambda c: charge.get(c, 0))
+        charge[creneau] = charge.get(creneau, 0) + 1
+        jour, (heure_debut, heure_fin) = creneau
+        plan[doc_id] = {"jour": jour, "heure_debut": heure_debut, "heure_fin": heure_fin, "jour_demande": jour_demande}
+    return plan
+
+def save_execution_plan(db, plan, mois_str):
+    """Enregistre le plan dans payflow_slots (un document par client et par mois)."""
+    if not db:
+        raise Exception("Client Firestore non dispo, plan non enregistré.")
+    planned_at = datetime.utcnow()
+    items = list(plan.items())
+    for i in range(0, len(items), 500): # Limite Firestore par batch
+        batch = db.batch()
+        for doc_id, slot in items[i:i + 500]:
+            slot_doc = dict(slot, client_doc_id=doc_id, mois=mois_str, planned_at=planned_at)
+            batch.set(db.collection(SLOTS_COLLECTION).document(f"{mois_str}_{doc_id}"), slot_doc)
+        batch.commit()
+    print(f"Plan {mois_str} enregistré: {len(plan)} clients.")
+
+def build_execution_plan(db, annee, mois, enregistrer=True):
+    """Lit tous les clients, calcule et enregistre le plan du mois (calcul en mémoire seulement si `enregistrer` est faux)."""
+    clients_config = {doc.id: doc.to_dict() for doc in db.collection("payflow_clients").stream()}
+    plan = plan_execution_slots(clients_config, annee, mois)
+    if enregistrer:
+        save_execution_plan(db, plan, f"{annee:04d}-{mois:02d}")
+    return plan
+
+def replan_client(db, doc_id, client_config, today):
+    """
+    Recalcule le créneau d'un client dans le plan du mois en cours (après modification
+    de son jour_transfert ou de sa tolérance), en tenant compte de la charge des autres
+    clients. Sans plan pour le mois, rien n'est fait : il sera calculé au premier passage.
+    Retourne le nouveau créneau, ou None s'il est inchangé ou s'il n'y a pas de plan.
+    """
+    mois_str = today.strftime('%Y-%m')
+    slots = {snap.id: snap.to_dict() for snap in db.collection(SLOTS_COLLECTION).where("mois", "==", mois_str).stream()}
+    if not slots:
+        return None
+    actuel = slots.pop(f"{mois_str}_{doc_id}", None)
+    charge = {}
+    for slot in slots.values():
+        creneau = (slot["jour"], (slot["heure_debut"], slot["heure_fin"]))
+        charge[creneau] = charge.get(creneau, 0) + 1
+    nouveau = plan_execution_slots({doc_id: client_config}, today.year, today.month, charge_initiale=charge)[doc_id]
+    if actuel and actuel.get("jour_demande") == nouveau["jour_demande"]: # Jour demandé inchangé : le créneau est conservé
+        return None
+    save_execution_plan(db, {doc_id: nouveau}, mois_str)
+    return nouveau
+
+def heure_locale(now_utc):
+    """Heure courante dans le fuseau du planificateur (Cloud Scheduler)."""
+    return now_utc.replace(tzinfo=ZoneInfo("UTC")).astimezone(ZoneInfo(PLANNER_TIMEZONE)).hour
+
+def dans_fenetre(heure, heure_debut, heure_fin):
+    """Vrai si l'heure est dans la fenêtre (toujours vrai s'il n'y a qu'une fenêtre configurée)."""
+    if len(PLANNER_FENETRES_HORAIRES) == 1:
+        return True
+    return heure_debut <= heure < heure_fin
+
+def get_due_clients(db, today, toutes_fenetres=False, enregistrer_plan=True):
+    """
+    Retourne les documents clients à traiter maintenant (ou sur toute la journée
+    si `toutes_fenetres`). Le plan du mois est construit à la volée s'il n'existe
+    pas encore (et n'est alors pas enregistré si `enregistrer_plan` est faux, ex: dry-run).
+    Les clients absents du plan (ajoutés après la planification) retombent sur leur
+    jour_transfert, ramené au dernier jour du mois si nécessaire.
+    """
+    mois_str = today.strftime('%Y-%m')
+    dernier_jour = calendar.monthrange(today.year, today.month)[1]
+    heure = None if toutes_fenetres else heure_locale(today)
+    slots_ref = db.collection(SLOTS_COLLECTION)
+
+    plan_memoire = None
+    if not list(slots_ref.where("mois", "==", mois_str).limit(1).stream()):
+        print(f"Aucun plan pour {mois_str}, calcul du plan{'' if enregistrer_plan else ' (non enregistré)'}...")
+        plan = build_execution_plan(db, today.year, today.month, enregistrer=enregistrer_plan)
+        if not enregistrer_plan:
+            plan_memoire = plan
+
+    if plan_memoire is not None:
+        slots = [dict(slot, client_doc_id=doc_id) for doc_id, slot in plan_memoire.items() if slot["jour"] == today.day]
+    else:
+        slots = [s.to_dict() for s in slots_ref.where("mois", "==", mois_str).where("jour", "==", today.day).stream()]
+    due_ids = [s["client_doc_id"] for s in slots if heure is None or dans_fenetre(heure, s["heure_debut"], s["heure_fin"])]
+
+    # Repli pour les clients non planifiés, traités dans la première fenêtre du jour.
+    if heure is None or dans_fenetre(heure, *PLANNER_FENETRES_HORAIRES[0]):
+        legacy_ref = db.collection("payflow_clients")
+        if today.day == dernier_jour:
+            legacy_query = legacy_ref.where("jour_transfert", ">=", today.day)
+        else:
+            legacy_query = legacy_ref.where("jour_transfert", "==", today.day)
+        legacy_ids = [doc.id for doc in legacy_query.stream()]
+        if legacy_ids:
+            if plan_memoire is not None:
+                planifies = {f"{mois_str}_{doc_id}" for doc_id in plan_memoire}
+            else:
+                slot_refs = [slots_ref.document(f"{mois_str}_{doc_id}") for doc_id in legacy_ids]
+                planifies = {snap.id for snap in db.get_all(slot_refs) if snap.exists}
+            due_ids += [doc_id for doc_id in legacy_ids if f"{mois_str}_{doc_id}" not in planifies]
+
+    if not due_ids:
+        return []
+    client_refs = [db.collection("payflow_clients").document(doc_id) for doc_id in dict.fromkeys(due_ids)]
+    return [snap for snap in db.get_all(client_refs) if snap.exists]
@@ -0,0 +1,147 @@
+"""
+Profilage à la demande d'un client : cProfile + tracemalloc autour de son import.
+
+Activé par le champ `profilage: true` du document client (payflow_clients) ou par
+PAYFLOW_PROFILE_CLIENTS (ID de documents séparés par des virgules, `*` = tous).
+Les autres clients du même run ne sont pas profilés. L'artefact (profil .pstats,
+top des fonctions et des allocations, durées des étapes) est écrit dans
+PAYFLOW_PROFILE_DIR et résumé dans payflow_profiles ; le log de l'import le
+référence via `profil_id`.
+
+cProfile ne suit que le thread de l'import profilé. tracemalloc, lui, trace tout
+le processus et ralentit chaque import concurrent : il n'est activé que si
+l'import profilé est seul en cours, et arrêté à l'étape suivante si un autre
+import démarre (le top des allocations est alors absent ou partiel).
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import tracemalloc
+from datetime import datetime, timezone
+
+from .pipeline import PipelineHook, imports_actifs
+
+PROFILES_COLLECTION = "payflow_profiles"
+PROFILE_DIR = os.environ.get("PAYFLOW_PROFILE_DIR", "/tmp/payflow_profiles")
+PROFILE_TOP = int(os.environ.get("PAYFLOW_PROFILE_TOP", "30"))
+
+# tracemalloc est global au processus : démarré au premier client profilé, arrêté après le dernier.
+_TRACE_LOCK = threading.Lock()
+_TRACE_USERS = 0
+
+def profiling_enabled(client_doc_id, client_config):
+    """Vrai si l'import de ce client doit être profilé (champ Firestore ou variable d'environnement)."""
+    if (client_config or {}).get("profilage"):
+        return True
+    clients = {c.strip() for c in os.environ.get("PAYFLOW_PROFILE_CLIENTS", "").split(",") if c.strip()}
+    return "*" in clients or str(client_doc_id) in clients
+
+def _trace_start():
+    global _TRACE_USERS
+    with _TRACE_LOCK:
+        if _TRACE_USERS == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+        _TRACE_USERS += 1
+
+def _trace_stop():
+    global _TRACE_USERS
+    with _TRACE_LOCK:
+        _TRACE_USERS -= 1
+        if _TRACE_USERS == 0:
+            tracemalloc.stop()
+
+def _top_fonctions(profil, top):
+    stats = pstats.Stats(profil)
+    lignes = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+    return [{"fonction": f"{os.path.basename(fichier)}:{ligne}({nom})", "appels": nc, "tottime_ms": round(tt * 1000, 1), "cumtime_ms": round(ct * 1000, 1)}
+            for (fichier, ligne, nom), (cc, nc, tt, ct, callers) in lignes]
+
+def _top_allocations(avant, apres, top):
+    """Allocations nettes entre deux snapshots (tracemalloc est global : inclut les autres threads actifs)."""
+    filtres = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>")]
+    diffs = apres.filter_traces(filtres).compare_to(avant.filter_traces(filtres), "lineno")[:top]
+    return [{"ligne": str(d.traceback[0]), "taille_ko": round(d.size_diff / 1024, 1), "nombre": d.count_diff} for d in diffs]
+
+
+class ProfilingHook(PipelineHook):
+    """Profile de fetch à create les imports des clients pour lesquels le profilage est activé."""
+
+    def __init__(self, db=None, profile_dir=PROFILE_DIR, top=PROFILE_TOP):
+        self.db = db
+        self.profile_dir = profile_dir
+        self.top = top
+        self._actifs = {} # id(ctx) -> état du profil (cProfile, snapshots tracemalloc)
+        self._lock = threading.Lock()
+
+    def before_stage(self, stage, ctx):
+        if stage == "fetch" and not ctx.status and profiling_enabled(ctx.client_doc_id, ctx.client_config):
+            actif = {"profil": cProfile.Profile(), "snapshot_initial": None, "snapshot_final": None, "pic": None,
+                     "allocations": "non mesurées (autres imports en cours)"}
+            if imports_actifs() <= 1: # Seul import du processus : tracemalloc ne ralentit personne
+                _trace_start()
+                actif.update(snapshot_initial=tracemalloc.take_snapshot(), allocations="complètes")
+            with self._lock:
+                self._actifs[id(ctx)] = actif
+            actif["profil"].enable() # cProfile ne suit que le thread courant, celui de l'import
+        elif stage == "log":
+            with self._lock:
+                actif = self._actifs.pop(id(ctx), None)
+            if actif:
+                actif["profil"].disable()
+                self._arreter_trace(actif)
+                self._terminer(ctx, actif)
+        else:
+            with self._lock:
+                actif = self._actifs.get(id(ctx))
+            if actif and actif["snapshot_initial"] is not None and actif["snapshot_final"] is None and imports_actifs() > 1:
+                self._arreter_trace(actif, allocations=f"partielles (arrêtées avant {stage} : autre import démarré)")
+        return False
+
+    def _arreter_trace(self, actif, allocations=None):
+        """Prend le snapshot final et libère tracemalloc (une seule fois par import)."""
+        if actif["snapshot_initial"] is None or actif["snapshot_final"] is not None:
+            return
+        try:
+            actif["snapshot_final"] = tracemalloc.take_snapshot()
+            actif["pic"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            _trace_stop()
+        if allocations:
+            actif["allocations"] = allocations
+
+    def _terminer(self, ctx, actif):
+        profil = actif["profil"]
+        profil_id = f"{ctx.client_doc_id}_{ctx.period_str}_{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}"
+        artefact = {
+            "client_doc_id": ctx.client_doc_id, "client_name": ctx.client_name, "period": ctx.period_str, "status": ctx.status,
+            "durees_ms": {s: round(t * 1000) for s, t in ctx.timings.items()},
+            "nb_lignes": len(ctx.lignes or []), "memoire_pic_ko": round(actif["pic"] / 1024, 1) if actif["pic"] is not None else None,
+            "top_fonctions": _top_fonctions(profil, self.top),
+            "allocations": actif["allocations"],
+            "top_allocations": _top_allocations(actif["snapshot_initial"], actif["snapshot_final"], self.top) if actif["snapshot_final"] else [],
+        }
+        try:
+            dossier = os.path.join(self.profile_dir, profil_id)
+            os.makedirs(dossier, exist_ok=True)
+            profil.dump_stats(os.path.join(dossier, "profile.pstats"))
+            texte = io.StringIO()
+            pstats.Stats(profil, stream=texte).sort_stats("cumulative").print_stats(self.top)
+            with open(os.path.join(dossier, "profile.txt"), "w", encoding="utf-8") as f:
+                f.write(texte.getvalue())
+            with open(os.path.join(dossier, "profile.json"), "w", encoding="utf-8") as f:
+                json.dump(artefact, f, ensure_ascii=False, indent=2)
+            artefact["fichier"] = dossier
+        except OSError as e:
+            print(f"AVERTISSEMENT: Profil non écrit sur disque ({profil_id}): {e}")
+
+        if self.db is not None:
+            try:
+                self.db.collection(PROFILES_COLLECTION).document(profil_id).set(dict(artefact, created_at=datetime.now(timezone.utc)))
+            except Exception as e:
+                print(f"AVERTISSEMENT: Profil non enregistré dans Firestore ({profil_id}): {e}")
+        ctx.extra["profil_id"] = profil_id
+        print(f"  Profil {profil_id}: " + ", ".join(f"{s}={t}ms" for s, t in artefact["durees_ms"].items()) + f", pic mémoire {artefact['memoire_pic_ko']} Ko (allocations {artefact['allocations']})")
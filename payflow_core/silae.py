@@ -0,0 +1,163 @@
+"""Client Silae : token OAuth2, écritures comptables et découpage par période."""
+
+import json
+import re
+import threading
+import time
+from datetime import datetime
+from urllib.parse import quote
+
+import pandas as pd
+import requests
+
+from .metrics import SILAE_SECONDS, record_cache
+from .silae_cache import silae_cache_get, silae_cache_put
+
+SILAE_AUTH_URL = "https://payroll-api-auth.silae.fr/oauth2/v2.0/token"
+SILAE_SCOPE = "https://silaecloudb2c.onmicrosoft.com/36658aca-9556-41b7-9e48-77e90b006f34/.default"
+SILAE_ECRITURES_URL = "https://payroll-api.silae.fr/payroll/v1/EcrituresComptables/EcrituresComptables4"
+
+# Token réutilisé jusqu'à 1 minute avant son expiration (par client_id).
+_TOKEN_CACHE = {}
+_TOKEN_LOCK = threading.Lock()
+
+def _details_erreur(e):
+    if e.response is None:
+        return ""
+    try: return e.response.json()
+    except json.JSONDecodeError: return e.response.text
+
+def get_silae_token(silae_config, use_cache=True):
+    """Obtient un token Silae (mis en cache en mémoire jusqu'à son expiration)."""
+    if not silae_config:
+        raise ValueError("Configuration Silae non chargée.")
+    client_id = quote(silae_config.get("client_id", ""))
+    client_secret = quote(silae_config.get("client_secret", ""))
+    if not client_id or not client_secret:
+        raise ValueError("ID Client ou Secret Client Silae manquant.")
+
+    if use_cache:
+        with _TOKEN_LOCK:
+            token, expire_a = _TOKEN_CACHE.get(client_id, (None, 0))
+        hit = bool(token) and time.monotonic() < expire_a
+        record_cache("silae_token", hit)
+        if hit:
+            return token
+
+    auth_data_string = f"grant_type=client_credentials&client_id={client_id}&client_secret={client_secret}&scope={quote(SILAE_SCOPE)}"
+    auth_headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    try:
+        with SILAE_SECONDS.time(endpoint="token"):
+            response = requests.post(SILAE_AUTH_URL, data=auth_data_string, headers=auth_headers, timeout=15)
+        response.raise_for_status()
+        payload = response.json()
+    except requests.exceptions.RequestException as e:
+        raise Exception(f"Échec de la requête du token Silae: {e} - Détails: {_details_erreur(e)}")
+
+    token = payload["access_token"]
+    with _TOKEN_LOCK:
+        _TOKEN_CACHE[client_id] = (token, time.monotonic() + max(int(payload.get("expires_in", 3600)) - 60, 0))
+    return token
+
+def clear_silae_token_cache():
+    """Oublie les tokens en cache (ex: à la déconnexion)."""
+    with _TOKEN_LOCK:
+        _TOKEN_CACHE.clear()
+
+def get_silae_ecritures(access_token, silae_config, numero_dossier, date_debut, date_fin, force_refresh=False):
+    """Récupère les écritures Silae (rejouées depuis le cache local sauf si `force_refresh`)."""
+    if not force_refresh:
+        cached = silae_cache_get(numero_dossier, date_debut, date_fin)
+        record_cache("silae_ecritures", cached is not None)
+        if cached is not None:
+            print(f"  Écritures Silae rejouées depuis le cache local (Dossier {numero_dossier}).")
+            return cached
+
+    subscription_key = silae_config.get("subscription_key")
+    if not subscription_key:
+        raise ValueError("Clé d'abonnement Silae manquante.")
+    api_headers = {"Authorization": f"Bearer {access_token}", "Ocp-Apim-Subscription-Key": subscription_key, "Content-Type": "application/json", "dossiers": str(numero_dossier)}
+    api_body = {"numeroDossier": str(numero_dossier), "periodeDebut": date_debut.strftime('%Y-%m-%d'), "periodeFin": date_fin.strftime('%Y-%m-%d'), "avecToutesLesRepartitionsAnalytiques": False}
+    try:
+        with SILAE_SECONDS.time(endpoint="ecritures"):
+            response_api = requests.post(SILAE_ECRITURES_URL, headers=api_headers, data=json.dumps(api_body), timeout=60)
+        response_api.raise_for_status()
+        data = response_api.json()
+    except requests.exceptions.RequestException as e:
+        raise Exception(f"Échec de la récupération des écritures Silae (Dossier {numero_dossier}): {e} - Détails: {_details_erreur(e)}")
+    silae_cache_put(numero_dossier, date_debut, date_fin, data)
+    return data
+
+def ecritures_vides(ecritures_data):
+    """Vrai si la réponse Silae ne contient aucune ligne dans sa première rupture."""
+    return not ecritures_data or not ecritures_data.get('ruptures') or not ecritures_data['ruptures'][0].get('ecritures')
+
+# --- Périodes ---
+
+def previous_month_period(today):
+    """Retourne (date_debut, date_fin, period_str) du mois précédant `today`."""
+    last_day_previous_month = today.replace(day=1) - pd.Timedelta(days=1)
+    first_day_previous_month = last_day_previous_month.replace(day=1)
+    return first_day_previous_month, last_day_previous_month, first_day_previous_month.strftime('%Y-%m')
+
+def iter_periodes(date_debut, date_fin):
+    """Liste des périodes mensuelles (period_str, début, fin) entre deux mois inclus."""
+    periodes = []
+    courant = datetime(date_debut.year, date_debut.month, 1)
+    while courant <= date_fin:
+        fin = courant + pd.DateOffset(months=1) - pd.DateOffset(days=1)
+        periodes.append((courant.strftime('%Y-%m'), courant, fin))
+        courant = courant + pd.DateOffset(months=1)
+    return periodes
+
+def _periode_depuis_valeur(valeur):
+    """Extrait 'YYYY-MM' d'une date Silae ('2025-03-31T00:00:00', '31/03/2025', '2025-03'), sinon None."""
+    if not isinstance(valeur, str):
+        return None
+    match = re.match(r"^(\d{4})-(\d{2})", valeur)
+    if match:
+        return f"{match.group(1)}-{match.group(2)}"
+    match = re.match(r"^\d{2}/(\d{2})/(\d{4})", valeur)
+    if match:
+        return f"{match.group(2)}-{match.group(1)}"
+    return None
+
+CHAMPS_PERIODE_RUPTURE = ('periode', 'periodePaie', 'dateEcriture')
+CHAMPS_DATE_ECRITURE = ('dateEcriture', 'date', 'periode')
+
+def _premiere_periode(donnees, champs):
+    return next((_periode_depuis_valeur(donnees.get(c)) for c in champs if _periode_depuis_valeur(donnees.get(c))), None)
+
+def split_ecritures_par_periode(ecritures_data, periods):
+    """
+    Découpe une réponse Silae couvrant plusieurs mois en une réponse par période.
+    Les lignes sont réparties selon leur propre date ; la période de la rupture
+    n'est utilisée que si ses lignes n'en portent aucune. Retourne None si le
+    rattachement est incertain (ligne hors des périodes demandées, lignes datées
+    et non datées mêlées, ou rupture contredite par ses lignes) : l'appelant
+    repasse alors sur un appel Silae par période.
+    """
+    par_periode = {p: [] for p in periods}
+    for rupture in (ecritures_data or {}).get('ruptures') or []:
+        lignes = rupture.get('ecritures') or []
+        periode_rupture = _premiere_periode(rupture, CHAMPS_PERIODE_RUPTURE)
+        periodes_lignes = [_premiere_periode(ligne, CHAMPS_DATE_ECRITURE) for ligne in lignes]
+
+        if not any(periodes_lignes): # Lignes non datées : seule la rupture indique la période
+            if periode_rupture not in par_periode:
+                if not lignes:
+                    continue
+                return None
+            par_periode[periode_rupture].append(rupture)
+            continue
+
+        if not all(periodes_lignes) or any(p not in par_periode for p in periodes_lignes):
+            return None
+        if periode_rupture and set(periodes_lignes) != {periode_rupture}:
+            return None
+        lignes_par_periode = {}
+        for periode_ligne, ligne in zip(periodes_lignes, lignes):
+            lignes_par_periode.setdefault(periode_ligne, []).append(ligne)
+        for periode_ligne, lignes_periode in lignes_par_periode.items():
+            par_periode[periode_ligne].append(dict(rupture, ecritures=lignes_periode))
+    return {p: {'ruptures': ruptures} for p, ruptures in par_periode.items()}
@@ -0,0 +1,86 @@
+"""Cache local des réponses Silae brutes (rejeu des imports sans nouvel appel Silae)."""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+
+SILAE_CACHE_DIR = os.environ.get("PAYFLOW_SILAE_CACHE_DIR", "/tmp/payflow_silae_cache")
+SILAE_CACHE_MAX_OCTETS = int(float(os.environ.get("PAYFLOW_SILAE_CACHE_MAX_MO", "200")) * 1024 * 1024)
+SILAE_CACHE_MAX_ENTREES = int(os.environ.get("PAYFLOW_SILAE_CACHE_MAX_ENTREES", "2000"))
+SILAE_CACHE_TTL_HEURES = float(os.environ.get("PAYFLOW_SILAE_CACHE_TTL_HEURES", "24"))
+
+def _silae_cache_dir(numero_dossier, date_debut, date_fin):
+    return os.path.join(SILAE_CACHE_DIR, str(numero_dossier), f"{date_debut:%Y-%m-%d}_{date_fin:%Y-%m-%d}")
+
+def silae_cache_put(numero_dossier, date_debut, date_fin, data):
+    """Stocke une réponse EcrituresComptables4 brute (gzip), adressée par le hash de son contenu."""
+    raw = json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    content_hash = hashlib.sha256(raw).hexdigest()
+    try:
+        dossier = _silae_cache_dir(numero_dossier, date_debut, date_fin)
+        os.makedirs(dossier, exist_ok=True)
+        path = os.path.join(dossier, f"{content_hash}.json.gz")
+        suffixe_tmp = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            with gzip.open(path + suffixe_tmp, "wb") as f:
+                f.write(raw)
+            os.replace(path + suffixe_tmp, path)
+        # Pointeur vers la dernière réponse obtenue pour ce (dossier, période).
+        with open(os.path.join(dossier, "LATEST") + suffixe_tmp, "w") as f:
+            json.dump({"hash": content_hash, "fetched_at": datetime.utcnow().timestamp()}, f)
+        os.replace(os.path.join(dossier, "LATEST") + suffixe_tmp, os.path.join(dossier, "LATEST"))
+        silae_cache_evict()
+    except OSError as e:
+        print(f"AVERTISSEMENT: Cache Silae non écrit (Dossier {numero_dossier}): {e}")
+    return content_hash
+
+def silae_cache_get(numero_dossier, date_debut, date_fin, max_age_heures=SILAE_CACHE_TTL_HEURES, content_hash=None):
+    """
+    Relit la dernière réponse mise en cache pour (dossier, période), ou celle de
+    `content_hash`. Retourne None si absente ou plus vieille que `max_age_heures`
+    (None = pas de limite, pour les rejeux et benchmarks).
+    """
+    dossier = _silae_cache_dir(numero_dossier, date_debut, date_fin)
+    try:
+        if content_hash is None:
+            with open(os.path.join(dossier, "LATEST")) as f:
+                latest = json.load(f)
+            if max_age_heures is not None and datetime.utcnow().timestamp() - latest["fetched_at"] > max_age_heures * 3600:
+                return None
+            content_hash = latest["hash"]
+        path = os.path.join(dossier, f"{content_hash}.json.gz")
+        with gzip.open(path, "rb") as f:
+            data = json.loads(f.read().decode("utf-8"))
+        os.utime(path) # LRU : l'accès rafraîchit l'entrée
+        return data
+    except (OSError, ValueError, KeyError):
+        return None
+
+def silae_cache_evict():
+    """Supprime les entrées les moins récemment utilisées au-delà des limites de taille et de nombre."""
+    entrees = []
+    for racine, _, fichiers in os.walk(SILAE_CACHE_DIR):
+        for nom in fichiers:
+            if nom.endswith(".json.gz"):
+                path = os.path.join(racine, nom)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entrees.append((stat.st_mtime, stat.st_size, path))
+    total = sum(taille for _, taille, _ in entrees)
+    nombre = len(entrees)
+    for _, taille, path in sorted(entrees):
+        if total <= SILAE_CACHE_MAX_OCTETS and nombre <= SILAE_CACHE_MAX_ENTREES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= taille
+        nombre -= 1
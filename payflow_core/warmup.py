@@ -0,0 +1,54 @@
+"""Warmup de la veille : pré-résolution Odoo (uid, journal, plan comptable) des clients du lendemain."""
+
+import os
+import xmlrpc.client
+from datetime import datetime, timedelta
+
+from .odoo import OdooSession, odoo_fingerprint
+
+WARMUP_COLLECTION = "payflow_warmup"
+WARMUP_TTL_HEURES = int(os.environ.get("PAYFLOW_WARMUP_TTL_HEURES", "36"))
+
+def prepare_odoo_client(client_config):
+    """
+    Authentifie le client Odoo et résout son journal de paie et le plan comptable
+    complet de la société (code -> id). Retourne (status, message, warmup).
+    """
+    champs = ('odoo_host', 'database_odoo', 'odoo_login', 'odoo_password', 'journal_paie_odoo', 'odoo_company_id')
+    if not all(client_config.get(c) for c in champs):
+        return "ERROR_CONFIG", "Configuration Odoo incomplète (host, db, login, password, journal ou société).", None
+    try:
+        session = OdooSession(client_config)
+        journal_id = session.resolve_journal()
+        if not journal_id:
+            return "ERROR_JOURNAL", f"Journal Odoo introuvable (Code: '{client_config.get('journal_paie_odoo')}') dans la société ID {client_config.get('odoo_company_id')}.", None
+        account_ids = session.load_all_accounts()
+    except xmlrpc.client.Fault as e:
+        return "ERROR_ODOO_RPC", f"Erreur Odoo (Fault): {str(e)}", None
+    except Exception as e:
+        return "ERROR_ODOO_AUTH" if "authentification" in str(e) else "ERROR_UNKNOWN", str(e), None
+
+    warmup = {
+        "fingerprint": odoo_fingerprint(client_config),
+        "uid": session.uid,
+        "journal_id": journal_id,
+        "account_ids": account_ids,
+        "prepared_at": datetime.utcnow(),
+    }
+    return "SUCCESS", f"{len(account_ids)} comptes résolus, journal ID {journal_id}.", warmup
+
+def load_warmups(db, client_docs):
+    """Charge les warmups encore valides des clients donnés ({client_doc_id: warmup})."""
+    if not db or not client_docs:
+        return {}
+    limite = datetime.utcnow() - timedelta(hours=WARMUP_TTL_HEURES)
+    refs = [db.collection(WARMUP_COLLECTION).document(doc.id) for doc in client_docs]
+    warmups = {}
+    for snap in db.get_all(refs):
+        data = snap.to_dict() if snap.exists else None
+        if data and data.get("prepared_at") and data["prepared_at"].replace(tzinfo=None) >= limite:
+            warmups[snap.id] = data
+    return warmups
+
+def save_warmup(db, client_doc_id, warmup):
+    db.collection(WARMUP_COLLECTION).document(client_doc_id).set(warmup)
@@ -1,204 +1,151 @@
-# main.py - Version 3.2 (Correction Syntaxe Odoo 'read')
+# main.py - Version 4.0 (Pipeline partagé payflow_core)
 
-import base64
-import json
 import os
+import sys
 import traceback
-from datetime import datetime
-import xmlrpc.client
-from urllib.parse import quote
-import pandas as pd 
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
-import requests
 from google.cloud import firestore, secretmanager
 
+try:
+    import payflow_core  # noqa: F401
+except ImportError: # Exécution depuis le dépôt : le package partagé est à la racine
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import payflow_core  # noqa: F401
+
+from payflow_core import (LOGS_ARCHIVE_URI_CONFIGUREE, ImportContext, ImportPipeline, LeaseHook, ProfilingHook, TimingHook,
+                          build_execution_plan, compact_logs, get_due_clients, get_project_id, get_silae_token, health_ok,
+                          load_warmups, prepare_odoo_client, previous_month_period, run_health_check, save_warmup)
+from payflow_core import load_silae_secrets as load_silae_secrets_core
+from payflow_core import log_execution as log_execution_core
+
+# Force un nouvel appel Silae au lieu de rejouer le cache local (ex: données corrigées dans Silae).
+SILAE_FORCE_REFRESH = os.environ.get("PAYFLOW_SILAE_FORCE_REFRESH", "").lower() in ("1", "true", "yes")
+
 # --- Initialisation des Clients GCP (Globale) ---
 try:
     SECRET_CLIENT = secretmanager.SecretManagerServiceClient()
     DB = firestore.Client(database="payflow-db") # Spécifie votre BDD
-    
-    PROJECT_ID = os.environ.get("GCP_PROJECT")
+
+    PROJECT_ID = get_project_id()
     if not PROJECT_ID:
-        PROJECT_ID = os.environ.get("GCLOUD_PROJECT")
-        if not PROJECT_ID:
-             raise Exception("Variable d'environnement GCP_PROJECT ou GCLOUD_PROJECT non définie.")
-            
+        raise Exception("Variable d'environnement GCP_PROJECT ou GCLOUD_PROJECT non définie.")
+
 except Exception as e:
     print(f"ERREUR CRITIQUE: Échec d'initialisation des clients GCP: {e}")
     SECRET_CLIENT = None
     DB = None
 
-# --- Fonctions Helpers (Authentification Silae - Inchangées) ---
+# --- Fonctions Helpers ---
 
 def load_silae_secrets():
     """Charge les secrets Silae depuis Secret Manager."""
-    if not SECRET_CLIENT or not PROJECT_ID:
-        raise Exception("Client Secret Manager non initialisé ou PROJECT_ID manquant.")
-
-    secrets_to_fetch = ["SILAE_CLIENT_ID", "SILAE_CLIENT_SECRET", "SILAE_SUBSCRIPTION_KEY"]
-    config = {}
     try:
-        for key in secrets_to_fetch:
-            name = f"projects/{PROJECT_ID}/secrets/{key}/versions/latest"
-            # --- CORRECTION : 'client' n'était pas défini ---
-            response = SECRET_CLIENT.access_secret_version(request={"name": name})
-            value = response.payload.data.decode("UTF-8").strip()
-            config_key = key.split('_', 1)[-1].lower()
-            config[config_key] = value
-        if not all(k in config for k in ['client_id', 'client_secret', 'subscription_key']):
-             raise ValueError("Un ou plusieurs secrets Silae sont manquants.")
-        return config
+        return load_silae_secrets_core(SECRET_CLIENT, PROJECT_ID)
     except Exception as e:
         print(f"ERREUR: Échec du chargement des secrets Silae: {e}")
-        raise 
-
-def get_silae_token(silae_config):
-    """Obtient un token Silae."""
-    auth_url = "https://payroll-api-auth.silae.fr/oauth2/v2.0/token"
-    try:
-        client_id = quote(silae_config.get("client_id", ""))
-        client_secret = quote(silae_config.get("client_secret", ""))
-        if not client_id or not client_secret:
-            raise ValueError("ID Client ou Secret Client Silae manquant.")
-        grant_type = "client_credentials"
-        scope = quote("https://silaecloudb2c.onmicrosoft.com/36658aca-9556-41b7-9e48-77e90b006f34/.default")
-        auth_data_string = f"grant_type={grant_type}&client_id={client_id}&client_secret={client_secret}&scope={scope}"
-        auth_headers = {"Content-Type": "application/x-www-form-urlencoded"}
-        response = requests.post(auth_url, data=auth_data_string, headers=auth_headers, timeout=15)
-        response.raise_for_status()
-        return response.json()["access_token"]
-    except requests.exceptions.RequestException as e:
-        error_details = ""
-        if e.response is not None:
-            try: error_details = e.response.json()
-            except json.JSONDecodeError: error_details = e.response.text
-        raise Exception(f"Échec de la requête du token Silae: {e} - Détails: {error_details}")
-
-def get_silae_ecritures(access_token, silae_config, numero_dossier, date_debut, date_fin):
-    """Récupère les écritures Silae."""
-    api_url = "https://payroll-api.silae.fr/payroll/v1/EcrituresComptables/EcrituresComptables4"
-    subscription_key = silae_config.get("subscription_key")
-    if not subscription_key:
-        raise ValueError("Clé d'abonnement Silae manquante.")
-    api_headers = {"Authorization": f"Bearer {access_token}", "Ocp-Apim-Subscription-Key": subscription_key, "Content-Type": "application/json", "dossiers": str(numero_dossier)}
-    api_body = {"numeroDossier": str(numero_dossier), "periodeDebut": date_debut.strftime('%Y-%m-%d'), "periodeFin": date_fin.strftime('%Y-%m-%d'), "avecToutesLesRepartitionsAnalytiques": False}
-    try:
-        response_api = requests.post(api_url, headers=api_headers, data=json.dumps(api_body), timeout=60)
-        response_api.raise_for_status()
-        return response_api.json()
-    except requests.exceptions.RequestException as e:
-        error_details = ""
-        if e.response is not None:
-            try: error_details = e.response.json()
-            except json.JSONDecodeError: error_details = e.response.text
-        raise Exception(f"Échec de la récupération des écritures Silae (Dossier {numero_dossier}): {e} - Détails: {error_details}")
-
-# --- MODIFICATION ICI ---
-def import_to_odoo_auto(client_config, ecritures_data, period_str):
-    """Tente d'importer les écritures dans Odoo via XML-RPC (Gère le Multi-Société)."""
-    host = client_config.get('odoo_host')
-    db = client_config.get('database_odoo')
-    username = client_config.get('odoo_login')
-    password = client_config.get('odoo_password')
-    journal_code = client_config.get('journal_paie_odoo')
-    
-    company_id = client_config.get('odoo_company_id') 
-
-    if not all([host, db, username, password, journal_code]):
-        raise ValueError("Configuration Odoo manquante (host, db, login, password ou journal).")
-    
-    if not company_id:
-        raise ValueError(f"ID de société Odoo (odoo_company_id) manquant pour le client {client_config.get('nom')}. Veuillez reconfigurer le client dans PayFlow.")
-
-    if ".odoo.com" in host:
-        url_common = f"https://{host}/xmlrpc/common"
-        url_object = f"https://{host}/xmlrpc/object"
-    else:
-        url_common = f"https://{host}/xmlrpc/2/common"
-        url_object = f"https://{host}/xmlrpc/2/object"
-
-    try:
-        journal_silae = ecritures_data['ruptures'][0]
-        lignes_silae = journal_silae.get('ecritures')
-        if not lignes_silae:
-            return "SUCCESS_EMPTY", "Journal Silae vide, rien à importer."
-
-        comptes_odoo_a_verifier = set()
-        lignes_pour_odoo = []
-        for ligne in lignes_silae:
-            code_compte = ligne['compte'] 
-            lignes_pour_odoo.append({'account_code': code_compte, 'name': ligne['libelle'], 'debit': ligne['valeur'] if ligne['sens'] == 'D' else 0.0, 'credit': ligne['valeur'] if ligne['sens'] == 'C' else 0.0})
-            comptes_odoo_a_verifier.add(code_compte)
-        
-        common = xmlrpc.client.ServerProxy(url_common)
-        uid = common.authenticate(db, username, password, {})
-        if not uid:
-            raise Exception("Échec d'authentification Odoo. Vérifiez les identifiants.")
-            
-        models = xmlrpc.client.ServerProxy(url_object)
-        
-        context = {'allowed_company_ids': [company_id]} 
-        
-        def execute(model, method, *args, **kwargs):
-            kwargs.setdefault('context', {}).update(context)
-            return models.execute_kw(db, uid, password, model, method, args, kwargs)
-
-        domain_comptes = [('code', 'in', list(comptes_odoo_a_verifier))]
-        fields_comptes = ['code', 'id']
-        account_data = execute('account.account', 'search_read', domain_comptes, fields=fields_comptes)
-        
-        code_to_id_map = {acc['code']: acc['id'] for acc in account_data}
-        comptes_manquants = comptes_odoo_a_verifier - set(code_to_id_map.keys())
-        if comptes_manquants:
-            return "ERROR_ACCOUNT", f"Comptes Odoo introuvables: {sorted(list(comptes_manquants))}. Vérifiez la liaison Silae ET que la bonne société Odoo est sélectionnée."
-
-        domain_journal = [('code', '=', journal_code)]
-        journal_id = execute('account.journal', 'search', domain_journal, limit=1)
-        if not journal_id:
-            return "ERROR_JOURNAL", f"Journal Odoo introuvable (Code: '{journal_code}') dans la société ID {company_id}. Vérifiez la config client."
-        journal_id = journal_id[0]
-        lignes_finales = []
-        for ligne in lignes_pour_odoo:
-            lignes_finales.append((0, 0, {'account_id': code_to_id_map[ligne['account_code']], 'name': ligne['name'], 'debit': ligne['debit'], 'credit': ligne['credit']}))
-        
-        move_vals = {'journal_id': journal_id, 'ref': journal_silae.get('libelle', f"Import Paie Silae {period_str}"), 'date': datetime.now().strftime('%Y-%m-%d'), 'line_ids': lignes_finales}
-        move_id = execute('account.move', 'create', move_vals)
-        
-        # --- CORRECTION ICI : [move_id] devient [move_id] (liste d'IDs) et le kwarg 'fields' devient une liste positionnelle ['name'] ---
-        move_info = execute('account.move', 'read', [move_id], ['name']) 
-        move_name = move_info[0].get('name') if move_info and move_info[0].get('name') else f"ID {move_id}"
-        return "SUCCESS", f"Pièce créée (Brouillon): {move_name}"
-    
-    except xmlrpc.client.Fault as e:
-        print(f"ERREUR XML-RPC (Client: {client_config.get('nom', 'N/A')}): {e.faultString}")
-        return "ERROR_ODOO_RPC", f"Erreur Odoo (Fault): {str(e)}"
-    except Exception as e:
-        print(f"ERREUR Inattendue (Import Odoo pour {client_config.get('nom', 'N/A')}): {e}")
-        traceback.print_exc()
-        return "ERROR_UNKNOWN", f"Erreur inattendue: {str(e)}"
-# --- FIN DE LA MODIFICATION ---
+        raise
 
 def log_execution(client_doc_id, client_name, period_str, status, message):
     """Enregistre le résultat dans la collection payflow_logs de Firestore."""
+    log_execution_core(DB, client_doc_id, client_name, period_str, status, message)
+
+# --- Planification des créneaux (payflow_slots) ---
+
+def plan_monthly_slots(event, context):
+    """
+    Fonction Cloud (Pub/Sub) de re-planification du mois courant.
+    À déclencher après des changements de configuration clients.
+    """
+    if not DB:
+        print("ERREUR CRITIQUE: Client Firestore non dispo. Arrêt.")
+        return
+    today = datetime.utcnow()
+    plan = build_execution_plan(DB, today.year, today.month)
+    charge = {}
+    for slot in plan.values():
+        charge[slot["jour"]] = charge.get(slot["jour"], 0) + 1
+    print(f"Plan {today.strftime('%Y-%m')}: " + ", ".join(f"J{j}={n}" for j, n in sorted(charge.items())))
+
+# --- Compaction des logs (archives Parquet) ---
+
+def compact_payflow_logs(event, context):
+    """
+    Fonction Cloud (Pub/Sub) hebdomadaire : déplace les logs plus anciens que
+    PAYFLOW_LOGS_RETENTION_JOURS vers les archives Parquet (PAYFLOW_LOGS_ARCHIVE_URI)
+    et les supprime de payflow_logs. Refuse de s'exécuter si PAYFLOW_LOGS_ARCHIVE_URI
+    n'est pas défini (le /tmp de l'instance serait perdu avec les logs).
+    """
+    if not DB:
+        print("ERREUR CRITIQUE: Client Firestore non dispo. Arrêt.")
+        return
+    if not LOGS_ARCHIVE_URI_CONFIGUREE:
+        print("ERREUR CRITIQUE: PAYFLOW_LOGS_ARCHIVE_URI non défini (ex: gs://<bucket>/payflow_logs). Compaction annulée, aucun log supprimé.")
+        return
+    bilan = compact_logs(DB)
+    print(f"Compaction terminée: {sum(bilan.values())} logs archivés" + (" (" + ", ".join(f"{m}={n}" for m, n in sorted(bilan.items())) + ")" if bilan else "") + ".")
+
+# --- Contrôle de santé planifié (payflow_health) ---
+
+def check_clients_health(event, context):
+    """
+    Fonction Cloud (Pub/Sub) de contrôle de santé de tous les clients, à planifier
+    avant les jours de transfert chargés. Les comptes de la dernière paie sont aussi
+    vérifiés si PAYFLOW_HEALTH_VERIFIER_COMPTES=1 (1 appel Silae par client).
+    """
+    if not DB:
+        print("ERREUR CRITIQUE: Client Firestore non dispo. Arrêt.")
+        return
+    verifier_comptes = os.environ.get("PAYFLOW_HEALTH_VERIFIER_COMPTES", "").lower() in ("1", "true", "yes")
+    clients_config = {doc.id: doc.to_dict() for doc in DB.collection("payflow_clients").stream()}
+    results = run_health_check(DB, clients_config, load_silae_secrets() if verifier_comptes else None, verifier_comptes=verifier_comptes,
+                               max_workers=int(os.environ.get("PAYFLOW_HEALTH_WORKERS", "8")))
+    erreurs = [r for r in results if not health_ok(r)]
+    for r in erreurs:
+        print(f"  Santé KO: {r['client_name']} - {r['detail']}")
+    print(f"Contrôle de santé terminé: {len(results)} clients, {len(erreurs)} en erreur.")
+
+# --- Warmup de la veille (pré-résolution Odoo) ---
+
+def warmup_next_day_clients(event, context):
+    """
+    Fonction Cloud (Pub/Sub) à déclencher la veille au soir : pré-résout et met
+    en cache l'uid Odoo, le journal et le plan comptable des clients planifiés
+    demain, et signale les problèmes (log WARMUP_ERROR_*) avant l'exécution réelle.
+    Le token Silae n'est pas préchargé : il expire avant le lendemain.
+    """
+    print(f"--- Démarrage du warmup PayFlow (ID Contexte: {context.event_id}) ---")
     if not DB:
-        print(f"ERREUR: Client Firestore non dispo, log non enregistré pour {client_doc_id}")
+        print("ERREUR CRITIQUE: Client Firestore non dispo. Arrêt.")
         return
-        
+
+    demain = datetime.utcnow() + timedelta(days=1)
+    _, _, period_str = previous_month_period(demain)
     try:
-        log_entry = {
-            "client_doc_id": client_doc_id,
-            "client_name": client_name,
-            "period": period_str,
-            "execution_time": datetime.utcnow(),
-            "status": status,
-            "message": message[:1500]
-        }
-        log_doc_id = f"{client_doc_id}_{period_str}_{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}"
-        DB.collection("payflow_logs").document(log_doc_id).set(log_entry)
-        print(f"Log enregistré pour {client_name} - Période: {period_str} - Statut: {status}")
-        
+        client_docs = get_due_clients(DB, demain, toutes_fenetres=True)
     except Exception as e:
-        print(f"ERREUR: Échec d'écriture du log Firestore pour {client_doc_id}: {e}")
+        print(f"ERREUR CRITIQUE: Échec de lecture des clients de demain. Arrêt. Erreur: {e}")
+        return
+    if not client_docs:
+        print(f"Aucun client planifié le {demain.strftime('%Y-%m-%d')}. Terminé.")
+        return
+    print(f"{len(client_docs)} clients à préparer pour le {demain.strftime('%Y-%m-%d')}.")
+
+    with ThreadPoolExecutor(max_workers=int(os.environ.get("PAYFLOW_WARMUP_WORKERS", "8"))) as executor:
+        resultats = list(executor.map(lambda doc: (doc, prepare_odoo_client(doc.to_dict())), client_docs))
+
+    ok_count = 0
+    for doc, (status, message, warmup) in resultats:
+        client_name = doc.to_dict().get("nom", doc.id)
+        if warmup:
+            save_warmup(DB, doc.id, warmup)
+            ok_count += 1
+            print(f"  Warmup OK: {client_name} - {message}")
+        else:
+            print(f"  Warmup KO: {client_name} - {status} - {message}")
+            log_execution(doc.id, client_name, period_str, f"WARMUP_{status}", message)
+    print(f"--- Warmup terminé. {ok_count} prêts, {len(resultats) - ok_count} problèmes signalés. ---")
 
 # --- Point d'Entrée de la Cloud Function (MODIFIÉ) ---
 
@@ -209,19 +156,12 @@ def process_monthly_import(event, context):
     les clients configurés pour ce jour-là.
     """
     print(f"--- Démarrage de la fonction PayFlow (ID Contexte: {context.event_id}) ---")
-    
+
     # 1. Déterminer la date du jour ET la période à traiter
     today = datetime.utcnow()
     current_day = today.day # Ex: 10
-    
-    first_day_current_month = today.replace(day=1)
-    last_day_previous_month = first_day_current_month - pd.Timedelta(days=1)
-    first_day_previous_month = last_day_previous_month.replace(day=1)
-    
-    date_debut = first_day_previous_month
-    date_fin = last_day_previous_month
-    period_str = date_debut.strftime('%Y-%m') # Ex: "2025-10"
-    
+    date_debut, date_fin, period_str = previous_month_period(today) # Ex: "2025-10"
+
     print(f"Jour actuel (UTC): {current_day}. Période de paie à traiter: {period_str}")
 
     # 2. Charger les secrets Silae
@@ -231,27 +171,31 @@ def process_monthly_import(event, context):
         print(f"ERREUR CRITIQUE: Secrets Silae introuvables. Arrêt. Erreur: {e}")
         return
 
-    # 3. Lire les clients DEPUIS FIRESTORE (FILTRÉ)
+    # 3. Lire les clients DEPUIS FIRESTORE (créneaux planifiés du jour)
     if not DB:
         print("ERREUR CRITIQUE: Client Firestore non dispo. Arrêt.")
         return
-        
+
     try:
-        clients_ref = DB.collection("payflow_clients").where(
-            "jour_transfert", "==", current_day
-        ).stream()
-        
-        client_docs = list(clients_ref)
+        client_docs = get_due_clients(DB, today)
         if not client_docs:
-            print(f"Aucun client configuré pour un transfert le {current_day} du mois. Terminé.")
+            print(f"Aucun client planifié pour le {current_day} du mois (créneau courant). Terminé.")
             return
-            
-        print(f"{len(client_docs)} clients trouvés à traiter pour aujourd'hui.")
-        
+
+        print(f"{len(client_docs)} clients trouvés à traiter pour ce créneau.")
+
     except Exception as e:
         print(f"ERREUR CRITIQUE: Échec de lecture des clients Firestore. Arrêt. Erreur: {e}")
         return
 
+    # 3b. Charger les pré-résolutions Odoo faites la veille (warmup)
+    try:
+        warmups = load_warmups(DB, client_docs)
+        print(f"{len(warmups)} clients préparés par le warmup.")
+    except Exception as e:
+        print(f"AVERTISSEMENT: Warmups illisibles, exécution à froid. Erreur: {e}")
+        warmups = {}
+
     # 4. Obtenir le token Silae
     try:
         silae_token = get_silae_token(silae_config)
@@ -262,43 +206,27 @@ def process_monthly_import(event, context):
         log_execution("GLOBAL", "Système PayFlow", period_str, "ERROR_SILAE_AUTH", f"Token Silae inaccessible: {e}")
         return
 
-    # 5. Boucle sur chaque client (maintenant filtré)
+    # 5. Boucle sur chaque client (maintenant filtré) : fetch → transform → resolve → create → log
+    pipeline = ImportPipeline(db=DB, hooks=[LeaseHook(DB), TimingHook(), ProfilingHook(DB)])
     processed_count = 0
+    skipped_count = 0
     error_count = 0
     for doc in client_docs:
         client_doc_id = doc.id
         client_config = doc.to_dict()
         client_name = client_config.get("nom", client_doc_id)
-        silae_dossier = client_config.get("numero_dossier_silae")
-
-        print(f"\n--- Traitement client: {client_name} (Dossier Silae: {silae_dossier}) ---")
-
-        if not silae_dossier:
-            print(f"Client {client_name} ignoré: 'numero_dossier_silae' manquant.")
-            log_execution(client_doc_id, client_name, period_str, "ERROR_CONFIG", "Dossier Silae non configuré dans Firestore.")
-            error_count += 1
-            continue
+        print(f"\n--- Traitement client: {client_name} (Dossier Silae: {client_config.get('numero_dossier_silae')}) ---")
 
         try:
-            # A. Récupérer écritures Silae
-            print(f"  Étape 1: Récupération des écritures Silae pour {period_str}...")
-            ecritures_silae = get_silae_ecritures(silae_token, silae_config, silae_dossier, date_debut, date_fin)
-            if not ecritures_silae or not ecritures_silae.get('ruptures') or not ecritures_silae['ruptures'][0].get('ecritures'):
-                 print("  Statut: Aucune écriture Silae trouvée pour cette période.")
-                 log_execution(client_doc_id, client_name, period_str, "SUCCESS_NO_DATA", "Aucune écriture Silae trouvée pour cette période.")
-                 processed_count += 1
-                 continue
-
-            # B. Tenter l'import Odoo
-            print("  Étape 2: Tentative d'import Odoo...")
-            status, message = import_to_odoo_auto(client_config, ecritures_silae, period_str)
-            print(f"  Statut: {status} - {message}")
-
-            # C. Logguer le résultat
-            log_execution(client_doc_id, client_name, period_str, status, message)
-            
+            ctx = ImportContext(client_doc_id, client_config, period_str, date_debut, date_fin, silae_config, silae_token,
+                                warmup=warmups.get(client_doc_id), force_refresh=SILAE_FORCE_REFRESH)
+            status, message = pipeline.run(ctx)
+            print(f"  Statut: {status} - {message} ({', '.join(f'{s}={t:.2f}s' for s, t in ctx.timings.items())})")
+
             if status.startswith("SUCCESS"):
                 processed_count += 1
+            elif status == "SKIPPED_LEASE": # Déjà traité par un autre worker (livraison Pub/Sub en double)
+                skipped_count += 1
             else:
                 error_count += 1
 
@@ -308,4 +236,4 @@ def process_monthly_import(event, context):
             log_execution(client_doc_id, client_name, period_str, "ERROR_FUNCTION", f"Erreur fonctionnelle: {e}")
             error_count += 1
 
-    print(f"\n--- Exécution du jour {current_day} terminée. {processed_count} succès, {error_count} erreurs. ---")
\ No newline at end of file
+    print(f"\n--- Exécution du jour {current_day} terminée. {processed_count} succès, {skipped_count} ignorés (bail), {error_count} erreurs. ---")